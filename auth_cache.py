@@ -0,0 +1,56 @@
+import os
+from bson import ObjectId
+import data_access
+from data_access import org_collection, user_collection
+from ttl_cache import TTLCache
+
+
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+# "Not found" answers are kept briefly so a bogus id cannot hammer Mongo,
+# but a newly created org or user becomes visible quickly.
+AUTH_NEGATIVE_TTL = float(os.getenv('AUTH_NEGATIVE_TTL', '15'))
+
+# Only the fields the request handlers read are cached
+ORG_FIELDS = {'organization': 1}
+USER_FIELDS = {'role': 1, 'username': 1, 'organization': 1}
+
+_orgs = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_users = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_NOT_FOUND = {}
+
+
+async def get_org(org_id):
+    org = _orgs.get(org_id)
+    if org is None:
+        org = await data_access.find_one(
+            org_collection, {"_id": ObjectId(org_id)}, ORG_FIELDS) or _NOT_FOUND
+        _orgs.set(org_id, org, None if org else AUTH_NEGATIVE_TTL)
+    return org or None
+
+
+async def get_user(user_id, org_id):
+    key = (user_id, org_id)
+    user = _users.get(key)
+    if user is None:
+        user = await data_access.find_one(
+            user_collection, {"_id": ObjectId(user_id), "organization": org_id}, USER_FIELDS) or _NOT_FOUND
+        _users.set(key, user, None if user else AUTH_NEGATIVE_TTL)
+    return user or None
+
+
+def invalidate_org(org_id):
+    _orgs.pop(org_id)
+    _users.discard_where(lambda key: key[1] == org_id)
+
+
+def invalidate_user(user_id, org_id=None):
+    if org_id is not None:
+        _users.pop((user_id, org_id))
+    else:
+        _users.discard_where(lambda key: key[0] == user_id)
+
+
+def clear():
+    _orgs.clear()
+    _users.clear()
@@ -0,0 +1,78 @@
+"""Local stand-in for the streaming chat endpoint.
+
+Answers every POST with an OpenAI-style SSE stream after a configurable
+time to first token, at a configurable token rate. Point the app at it with
+INITIALIZ_URL=http://127.0.0.1:9000/chat.
+
+Run from the repository root:  python -m bench.fake_llm_server --ttfb 0.5
+"""
+import json
+import asyncio
+import argparse
+import threading
+from itertools import count
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+WORDS = ('The project is on track and the next milestone is the site visit '
+         'scheduled for the coming week with the client').split()
+
+
+def make_app(ttfb=0.2, token_rate=50.0, tokens=60, status=200, stall_every=0, stall=5.0):
+    """``stall_every`` > 0 makes every n-th request, starting with the first, wait ``stall`` extra seconds
+    before its first token, to exercise first-token timeouts and hedging."""
+    app = FastAPI()
+    requests = count(1)
+    app.state.calls = 0
+
+    @app.post("/chat")
+    async def chat():
+        n = next(requests)
+        app.state.calls = n
+        if status != 200:
+            return JSONResponse({"error": "fake failure"}, status_code=status)
+
+        async def events():
+            delay = ttfb + (stall if stall_every and (n - 1) % stall_every == 0 else 0)
+            await asyncio.sleep(delay)
+            for i in range(tokens):
+                chunk = {"choices": [{"delta": {"content": WORDS[i % len(WORDS)] + ' '}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if token_rate:
+                    await asyncio.sleep(1 / token_rate)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def serve_in_thread(app, port):
+    """Start ``app`` on 127.0.0.1:``port`` in a daemon thread; returns the server."""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, name='fake-llm', daemon=True)
+    thread.start()
+    while not server.started:
+        threading.Event().wait(0.01)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--ttfb', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--token-rate', type=float, default=50, help='tokens per second, 0 for no pause')
+    parser.add_argument('--tokens', type=int, default=60, help='tokens per answer')
+    parser.add_argument('--status', type=int, default=200, help='answer every request with this status')
+    parser.add_argument('--stall-every', type=int, default=0, help='stall every n-th request')
+    parser.add_argument('--stall', type=float, default=5.0, help='extra seconds a stalled request waits')
+    args = parser.parse_args()
+    import uvicorn
+    uvicorn.run(make_app(args.ttfb, args.token_rate, args.tokens, args.status,
+                         args.stall_every, args.stall),
+                host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Synthetic CRM data shaped like the production collections."""
+import random
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+
+PHASES = ['design', 'execution', 'completed', 'on hold']
+STATUSES = ['Pending', 'In Progress', 'Completed', 'Cancelled']
+PRIORITIES = ['Low', 'Medium', 'High', 'Urgent']
+LEAD_STATUSES = ['Interested', 'Not Interested', 'Follow Up', 'Contacted', 'No Response']
+WORDS = ['villa', 'office', 'kitchen', 'lobby', 'tower', 'studio', 'suite', 'garden',
+         'penthouse', 'cafe', 'clinic', 'loft', 'showroom', 'terrace', 'atrium']
+FIRST = ['Asha', 'Ravi', 'Meera', 'Karan', 'Neha', 'Arjun', 'Priya', 'Vikram', 'Sara', 'Dev']
+LAST = ['Sharma', 'Patel', 'Iyer', 'Khan', 'Gupta', 'Rao', 'Singh', 'Das', 'Mehta', 'Nair']
+
+
+def _date(rng, base=datetime(2024, 1, 1)):
+    return base + timedelta(days=rng.randint(0, 600), hours=rng.randint(0, 23))
+
+
+def _name(rng, i):
+    return f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}"
+
+
+def _letters(i):
+    # Task names take letters only, like the ones the intent parser accepts
+    text = ''
+    while True:
+        text = chr(ord('a') + i % 26) + text
+        i = i // 26 - 1
+        if i < 0:
+            return text
+
+
+def make_org(projects=50, leads=200, tasks_per_project=10, users=20, seed=7):
+    """Return ``{collection: [documents]}`` for one organisation."""
+    rng = random.Random(seed)
+    org_id = ObjectId()
+    org = str(org_id)
+    data = {'organisation': [{'_id': org_id, 'organization': 'Acme Interiors',
+                              'email': 'admin@acme.example', 'createdAt': _date(rng)}]}
+
+    project_docs = []
+    for i in range(projects):
+        project_docs.append({
+            '_id': ObjectId(), 'project_id': f"COLP-{100000 + i}", 'org_id': org,
+            'project_name': f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+            'client': [{'client_name': _name(rng, i), 'client_email': f"client{i}@example.com",
+                        'client_contact': str(9000000000 + i)}],
+            'project_status': rng.choice(PHASES), 'project_type': rng.choice(['residential', 'commercial']),
+            'description': ' '.join(rng.choice(WORDS) for _ in range(30)),
+            'project_start_date': _date(rng), 'timeline_date': _date(rng),
+            'project_budget': str(rng.randint(10, 500) * 10000), 'designer': _name(rng, i),
+            'visualizer': None, 'supervisor': '', 'fileId': f"FL-{i}",
+            'project_updated_by': [{'username': _name(rng, j), 'role': 'ADMIN',
+                                    'message': 'updated status', 'updated_date': _date(rng)}
+                                   for j in range(5)],
+        })
+    data['project'] = project_docs
+
+    task_docs = []
+    for project in project_docs:
+        for j in range(tasks_per_project):
+            task_docs.append({
+                '_id': ObjectId(), 'task_id': f"TK-{len(task_docs)}", 'org_id': org,
+                'project_id': project['project_id'],
+                'task_name': f"{rng.choice(WORDS)} work {_letters(j)}",
+                'task_description': ' '.join(rng.choice(WORDS) for _ in range(20)),
+                'actual_task_start_date': '', 'actual_task_end_date': None,
+                'estimated_task_start_date': _date(rng), 'estimated_task_end_date': _date(rng),
+                'task_status': rng.choice(STATUSES), 'task_priority': rng.choice(PRIORITIES),
+                'task_createdOn': _date(rng), 'reporter': _name(rng, j),
+                'task_assignee': _name(rng, j), 'task_createdBy': _name(rng, j),
+                'subtasks': [], 'task_time': {'total_time': '00:00:00'},
+            })
+    data['task'] = task_docs
+
+    lead_docs = []
+    for i in range(leads):
+        lead_docs.append({
+            '_id': ObjectId(), 'lead_id': f"LD-{i}", 'org_id': org, 'name': _name(rng, i),
+            'lead_manager': _name(rng, i), 'email': f"lead{i}@example.com",
+            'phone': str(8000000000 + i), 'location': rng.choice(['Pune', 'Delhi', 'Mumbai']),
+            'status': rng.choice(LEAD_STATUSES), 'source': rng.choice(['Website', 'Referral', 'Ads']),
+            'date': _date(rng), 'updated_date': _date(rng), 'fileId': f"FL-L{i}",
+            'notes': [{'content': ' '.join(rng.choice(WORDS) for _ in range(12)),
+                       'createdBy': _name(rng, k), 'date': _date(rng), 'status': rng.choice(LEAD_STATUSES)}
+                      for k in range(3)],
+            'contract': [], 'lead_update_track': [],
+        })
+    data['Lead'] = lead_docs
+
+    user_docs = []
+    for i in range(users):
+        user_docs.append({
+            '_id': ObjectId(), 'username': f"user{i}", 'email': f"user{i}@acme.example",
+            'organization': org, 'role': ['ADMIN', 'Senior Architect', '3D Visualizer', 'Designer'][i % 4],
+            'password': 'x' * 60, 'refreshToken': 'y' * 180, 'status': True,
+            'userProfile': f"https://cdn.example/u{i}.png",
+            'data': [{'projectData': [{'project_id': p['project_id'], 'role': 'member'}
+                                      for p in rng.sample(project_docs, min(5, len(project_docs)))],
+                      'leadData': [{'lead_id': lead['lead_id'], 'role': 'member'}
+                                   for lead in rng.sample(lead_docs, min(10, len(lead_docs)))],
+                      'notificationData': []}],
+        })
+    data['users'] = user_docs
+    return data
@@ -0,0 +1,67 @@
+"""Upstream gateway behaviour against the local fake chat server.
+
+Runs a few scenarios (normal stream, provider errors tripping the breaker,
+overload, a stalled first token with and without hedging) and prints what
+each request got back.
+
+Run from the repository root:  python -m bench.gateway
+"""
+import time
+import asyncio
+import llm_client
+import upstream_gateway
+from bench.fake_llm_server import make_app, serve_in_thread
+
+
+DATA = {"model": "fake", "messages": [], "stream": True}
+
+
+async def ask(org_id='org'):
+    started = time.perf_counter()
+    try:
+        call = await upstream_gateway.open_call(org_id, DATA)
+        first = None
+        chunks = 0
+        async for _ in call.chunks():
+            chunks += 1
+            first = first or time.perf_counter() - started
+        return f"ok {chunks} chunks, first after {first:.2f}s, total {time.perf_counter() - started:.2f}s"
+    except upstream_gateway.GatewayError as e:
+        return f"{e.status_code} {e} after {time.perf_counter() - started:.2f}s"
+
+
+async def scenario(name, port, settings, requests, **server):
+    server = serve_in_thread(make_app(**server), port)
+    llm_client.INITIALIZ_URL = f'http://127.0.0.1:{port}/chat'
+    for key, value in settings.items():
+        setattr(upstream_gateway, key, value)
+    upstream_gateway.breaker = upstream_gateway.CircuitBreaker(
+        upstream_gateway.LLM_BREAKER_FAILURES, upstream_gateway.LLM_BREAKER_RESET)
+    upstream_gateway._admission = None
+    print(f"\n{name}")
+    for batch in requests:
+        results = await asyncio.gather(*(ask() for _ in range(batch)))
+        for result in results:
+            print(f"  {result}")
+    print(f"  gateway: {upstream_gateway.stats()}")
+    await llm_client.close_client()
+    server.should_exit = True
+
+
+async def main():
+    await scenario("normal", 9101, {}, [2], ttfb=0.05, tokens=20)
+    await scenario("provider errors open the breaker", 9102,
+                   {'LLM_BREAKER_FAILURES': 3}, [1, 1, 1, 1], status=500)
+    await scenario("overload: 1 slot, 1 waiting, 4 at once", 9103,
+                   {'LLM_GLOBAL_CONCURRENCY': 1, 'LLM_QUEUE_SIZE': 1, 'LLM_QUEUE_TIMEOUT': 2},
+                   [4], ttfb=0.2, tokens=10)
+    await scenario("stalled first token, no hedging", 9104,
+                   {'LLM_FIRST_TOKEN_TIMEOUT': 1, 'LLM_HEDGE_AFTER': 0},
+                   [1], ttfb=0.05, tokens=10, stall_every=1, stall=3)
+    await scenario("stalled first token, hedged after 0.3s", 9105,
+                   {'LLM_FIRST_TOKEN_TIMEOUT': 2, 'LLM_HEDGE_AFTER': 0.3},
+                   [1], ttfb=0.05, tokens=10, stall_every=2, stall=3)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
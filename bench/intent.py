@@ -0,0 +1,68 @@
+"""Per-question parse cost: the old inline parsing against intent.parse.
+
+Run from the repository root:  python -m bench.intent
+"""
+import re
+import time
+import intent
+
+
+QUESTIONS = [
+    'hi',
+    'Hello, show me all projects',
+    'What is the status of project Sunrise Villa',
+    'List all tasks of project Sunrise Villa',
+    'When is task kitchen fitting of project Sunrise Villa due',
+    'Give me all leads',
+    'Any update of lead Ravi Sharma',
+    'Who is user meera',
+    'more leads',
+]
+
+
+def legacy_parse(question):
+    # The parsing query_rag_system did inline before intent.py
+    project_id = lead_id = task_id = None
+    project_name = lead_name = task_name = None
+    casual_greetings = ["Hello", "hello", "Hi", "hi", "hey", "greetings",
+                        "good morning", "good afternoon", "good evening", "good day", "hey there"]
+    greeting = any(greeting in question.lower() for greeting in casual_greetings)
+    if any(phrase in question.lower() for phrase in ["entire projects", "all projects", "whole projects", "all project"]):
+        project_id = '00000000000'
+    else:
+        match = re.search(r' of project ([\w\s]+)', question, re.IGNORECASE)
+        project_name = match.group(1) if match else None
+    if any(phrase in question.lower() for phrase in ["entire leads", "all leads", "all lead", "whole leads"]):
+        lead_id = '111111'
+    else:
+        match = re.search(r'of lead ([\w\s]+)', question, re.IGNORECASE)
+        lead_name = match.group(1) if match else None
+    if any(phrase in question.lower() for phrase in ["entire tasks", "all tasks", "all task", "whole tasks"]):
+        task_id = '222222222'
+    else:
+        match = re.search(r'task\s+([a-zA-Z\s]+?)(?=\s+of|\s*$)', question, re.IGNORECASE)
+        task_name = match.group(1).strip() if match else None
+    match = re.search(r'user ([\w\s]+)', question, re.IGNORECASE)
+    user_name = match.group(1) if match else None
+    return greeting, project_id, lead_id, task_id, project_name, lead_name, task_name, user_name
+
+
+def per_question(fn, repeat=20000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question in QUESTIONS:
+            fn(question)
+    return (time.perf_counter() - start) / (repeat * len(QUESTIONS)) * 1e6
+
+
+def main():
+    legacy = per_question(legacy_parse)
+    single_pass = per_question(intent.parse.__wrapped__)
+    memoized = per_question(intent.parse)
+    print(f"legacy inline parse      {legacy:6.2f} us/question")
+    print(f"single pass, no memo     {single_pass:6.2f} us/question")
+    print(f"single pass, memoized    {memoized:6.2f} us/question")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""Load and latency benchmark against local stand-ins for Mongo and the LLM.
+
+Starts the fake chat server (bench.fake_llm_server) and the app, seeded
+into mongomock from bench.fixtures, each in its own process. Then drives
+/query/ at a fixed concurrency with a weighted mix of question types, and
+reports latency and time-to-first-event percentiles, requests/sec and the
+app's RSS.
+Results are saved as JSON under bench/results/ so runs can be compared with
+--compare.
+
+Needs mongomock and uvicorn. mongomock has no $lookup sub-pipelines, so the
+app runs with MONGO_LOOKUP_PIPELINE=0. Run from the repository root:
+
+    python -m bench.load --concurrency 32 --requests 2000
+    python -m bench.load --label after --compare bench/results/before.json
+
+Settings of the app itself (LLM_ORG_CONCURRENCY, PROMPT_TOKEN_BUDGET, ...)
+are read from the environment as usual. All requests come from one
+organisation, so LLM_ORG_CONCURRENCY caps the LLM calls in flight.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from collections import defaultdict
+from bench.fixtures import make_org
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+DEFAULT_MIX = ('greeting=1,all_projects=1,project=2,project_task=2,all_tasks=1,'
+               'lead=2,all_leads=1,user=1')
+
+TEMPLATES = {
+    'greeting': lambda d, r: r.choice(['hi', 'hello there', 'good morning']),
+    'all_projects': lambda d, r: 'show me all projects',
+    'project': lambda d, r: f"what is the status of project {r.choice(d['project'])['project_name']}",
+    'project_task': lambda d, r: _task_question(d, r),
+    'all_tasks': lambda d, r: f"list all tasks of project {r.choice(d['project'])['project_name']}",
+    'lead': lambda d, r: f"any update of lead {r.choice(d['Lead'])['name']}",
+    'all_leads': lambda d, r: 'give me all leads',
+    'user': lambda d, r: f"who is user {r.choice(d['users'])['username']}",
+}
+
+
+def _task_question(data, rng):
+    task = rng.choice(data['task'])
+    project = next(p for p in data['project'] if p['project_id'] == task['project_id'])
+    return f"when is task {task['task_name']} of project {project['project_name']} due"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in TEMPLATES:
+            raise SystemExit(f"Unknown question type {kind!r}; known: {', '.join(TEMPLATES)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def serve(args):
+    """Run the app on mongomock; writes the seeded ids to ``args.ready_file``."""
+    import mongomock
+    import uvicorn
+    os.environ.setdefault('DATABASE_NAME', 'bench')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # mongomock has no $lookup sub-pipelines
+    os.environ['MONGO_LOOKUP_PIPELINE'] = '0'
+    if not args.answer_cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    import data_access
+    data_access.client = mongomock.MongoClient()
+    data_access.db = data_access.client[os.environ['DATABASE_NAME']]
+    import indexes
+    indexes.db = data_access.db
+    data = make_org(args.projects, args.leads, args.tasks_per_project, args.users, args.seed)
+    for collection, docs in data.items():
+        data_access.db[collection].insert_many(docs)
+    import llm_client
+    llm_client.INITIALIZ_URL = args.llm_url
+    import index
+    server = uvicorn.Server(uvicorn.Config(index.app, host='127.0.0.1', port=args.port,
+                                           log_level='warning', access_log=False))
+    org_id = str(data['organisation'][0]['_id'])
+    users = [[str(u['_id']), u['role']] for u in data['users']]
+    with open(args.ready_file, 'w') as ready:
+        json.dump({'org_id': org_id, 'users': users}, ready)
+    server.run()
+
+
+def start(command, env=None):
+    return subprocess.Popen([sys.executable, '-m'] + command, env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+async def wait_ready(url, process, timeout=60):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit(f"{' '.join(process.args)} exited with {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise SystemExit(f"{url} did not come up in {timeout}s")
+
+
+async def one_request(client, url, body):
+    started = time.perf_counter()
+    first = None
+    size = 0
+    async with client.stream('POST', url, json=body) as response:
+        async for chunk in response.aiter_raw():
+            if first is None:
+                first = time.perf_counter() - started
+            size += len(chunk)
+    return response.status_code, time.perf_counter() - started, first, size
+
+
+async def drive(args, ids, app_pid):
+    import httpx
+    data = make_org(args.projects, args.leads, args.tasks_per_project, args.users, args.seed)
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    url = f'http://127.0.0.1:{args.port}/query/'
+
+    def next_request():
+        kind = rng.choices(kinds, weights)[0]
+        user_id, _ = rng.choice(ids['users'])
+        return kind, {'question': TEMPLATES[kind](data, rng), 'org_id': ids['org_id'], 'user_id': user_id}
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120)) as client:
+        # Warm-up builds the entity index and fills the auth cache
+        for _ in range(args.warmup):
+            await one_request(client, url, next_request()[1])
+
+        samples = []
+        rss = []
+        remaining = args.requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                kind, body = next_request()
+                try:
+                    status, total, first, size = await one_request(client, url, body)
+                except httpx.HTTPError as e:
+                    status, total, first, size = type(e).__name__, None, None, 0
+                samples.append((kind, status, total, first, size))
+
+        async def sample_rss():
+            while True:
+                rss.append(rss_bytes(app_pid))
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.ensure_future(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        rss.append(rss_bytes(app_pid))
+    return samples, elapsed, [r for r in rss if r is not None]
+
+
+def summarize(samples, elapsed, rss):
+    def stats(rows):
+        ok = [row for row in rows if row[1] == 200]
+        latency = [row[2] for row in ok]
+        first = [row[3] for row in ok if row[3] is not None]
+        errors = defaultdict(int)
+        for row in rows:
+            if row[1] != 200:
+                errors[str(row[1])] += 1
+        ms = lambda v: None if v is None else round(v * 1000, 1)
+        return {
+            'requests': len(rows), 'ok': len(ok), 'errors': dict(errors),
+            'latency_ms': {f'p{p}': ms(percentile(latency, p)) for p in (50, 95, 99)},
+            'first_event_ms': {f'p{p}': ms(percentile(first, p)) for p in (50, 95, 99)},
+            'bytes_per_answer': round(sum(row[4] for row in ok) / len(ok)) if ok else None,
+        }
+
+    by_kind = defaultdict(list)
+    for row in samples:
+        by_kind[row[0]].append(row)
+    overall = stats(samples)
+    overall['requests_per_sec'] = round(len(samples) / elapsed, 1)
+    overall['elapsed_s'] = round(elapsed, 2)
+    overall['rss_mb'] = {'max': round(max(rss) / 2**20, 1), 'end': round(rss[-1] / 2**20, 1)} if rss else None
+    return overall, {kind: stats(rows) for kind, rows in sorted(by_kind.items())}
+
+
+def report(overall, kinds, previous=None):
+    print(f"{'':<14}{'n':>6}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfe50':>9}{'ttfe95':>9}{'ttfe99':>9}")
+
+    def row(name, s):
+        lat, first = s['latency_ms'], s['first_event_ms']
+        print(f"{name:<14}{s['requests']:>6}{s['requests'] - s['ok']:>6}"
+              + ''.join(f"{'-' if v is None else v:>9}" for v in (*lat.values(), *first.values())))
+    for kind, s in kinds.items():
+        row(kind, s)
+    row('all', overall)
+    rss = overall['rss_mb']
+    rss = f"max {rss['max']} MB, end {rss['end']} MB" if rss else 'unknown'
+    print(f"\n{overall['requests_per_sec']} req/s over {overall['elapsed_s']}s, app RSS {rss}, "
+          f"errors {overall['errors'] or 'none'}")
+    if previous:
+        before = previous['overall']
+        print(f"\nagainst {previous.get('label')}:")
+        for key, now, then in (
+                ('req/s', overall['requests_per_sec'], before['requests_per_sec']),
+                ('p50 ms', overall['latency_ms']['p50'], before['latency_ms']['p50']),
+                ('p95 ms', overall['latency_ms']['p95'], before['latency_ms']['p95']),
+                ('p99 ms', overall['latency_ms']['p99'], before['latency_ms']['p99']),
+                ('ttfe p50 ms', overall['first_event_ms']['p50'], before['first_event_ms']['p50']),
+                ('ttfe p95 ms', overall['first_event_ms']['p95'], before['first_event_ms']['p95'])):
+            if now is not None and then:
+                print(f"  {key:<12}{then:>10} -> {now:<10}({(now - then) / then * 100:+.1f}%)")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='question type weights, e.g. "project=2,user=1"')
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--leads', type=int, default=500)
+    parser.add_argument('--tasks-per-project', type=int, default=15)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--ttfb', type=float, default=0.3, help='fake LLM seconds to first token')
+    parser.add_argument('--token-rate', type=float, default=80, help='fake LLM tokens per second')
+    parser.add_argument('--tokens', type=int, default=60, help='fake LLM tokens per answer')
+    parser.add_argument('--answer-cache', action='store_true', help='keep the answer cache on')
+    parser.add_argument('--label', default=None, help='name of the results file')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare with')
+    # Used by the app process this script starts
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--llm-url', help=argparse.SUPPRESS)
+    parser.add_argument('--ready-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    llm_port, args.port = free_port(), free_port()
+    ready_file = os.path.join(RESULTS_DIR, f'.ready-{os.getpid()}')
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    llm = start(['bench.fake_llm_server', '--port', str(llm_port), '--ttfb', str(args.ttfb),
+                 '--token-rate', str(args.token_rate), '--tokens', str(args.tokens)])
+    app_args = ['bench.load', '--serve', '--port', str(args.port),
+                '--llm-url', f'http://127.0.0.1:{llm_port}/chat', '--ready-file', ready_file,
+                '--projects', str(args.projects), '--leads', str(args.leads),
+                '--tasks-per-project', str(args.tasks_per_project), '--users', str(args.users),
+                '--seed', str(args.seed)] + (['--answer-cache'] if args.answer_cache else [])
+    app = start(app_args)
+    try:
+        asyncio.run(wait_ready(f'http://127.0.0.1:{llm_port}/', llm))
+        asyncio.run(wait_ready(f'http://127.0.0.1:{args.port}/cache/stats', app))
+        with open(ready_file) as ready:
+            ids = json.load(ready)
+        samples, elapsed, rss = asyncio.run(drive(args, ids, app.pid))
+    finally:
+        app.terminate()
+        llm.terminate()
+        app.wait()
+        llm.wait()
+        if os.path.exists(ready_file):
+            os.remove(ready_file)
+
+    overall, kinds = summarize(samples, elapsed, rss)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(overall, kinds, previous)
+
+    label = args.label or time.strftime('%Y%m%d-%H%M%S')
+    config = {k: v for k, v in vars(args).items()
+              if k not in ('serve', 'port', 'llm_url', 'ready_file', 'label', 'compare')}
+    path = os.path.join(RESULTS_DIR, f'{label}.json')
+    with open(path, 'w') as f:
+        json.dump({'label': label, 'revision': git_revision(), 'python': platform.python_version(),
+                   'config': config, 'overall': overall, 'by_type': kinds}, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == '__main__':
+    main()
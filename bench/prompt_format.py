@@ -0,0 +1,45 @@
+"""Compare the old repr() prompt context with prompt_format.serialize_context.
+
+Run from the repository root:  python -m bench.prompt_format
+"""
+import time
+from bench.fixtures import make_org
+from field_specs import PROJECT_SUMMARY, TASK_SUMMARY, LEAD_SUMMARY
+from prompt_format import estimate_tokens, serialize_context
+
+
+def contexts(data):
+    project = data['project'][0]
+    detail = {k: v for k, v in project.items() if k not in ['_id', 'project_id', 'org_id', 'fileId']}
+    detail['assignees'] = [u['username'] for u in data['users'][:6]]
+    return {
+        'project detail': detail,
+        'lead detail': {k: v for k, v in data['Lead'][0].items() if k not in ['_id', 'lead_id', 'org_id']},
+        'all projects': {'projects': [PROJECT_SUMMARY.shape(p) for p in data['project']]},
+        'tasks of project': {'tasks': [TASK_SUMMARY.shape(t) for t in data['task']
+                                       if t['project_id'] == project['project_id']]},
+        'all leads': {'leads': [LEAD_SUMMARY.shape(lead) for lead in data['Lead']]},
+    }
+
+
+def timed(fn, arg, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = fn(arg)
+    return text, (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    data = make_org(projects=50, leads=200, tasks_per_project=12)
+    print(f"{'context':<18}{'repr B':>10}{'compact B':>11}{'repr tok':>10}"
+          f"{'compact tok':>13}{'saved':>8}{'us':>8}")
+    for name, context in contexts(data).items():
+        old, _ = timed(str, context, 1)
+        new, micros = timed(serialize_context, context, 20)
+        old_tokens, new_tokens = estimate_tokens(old), estimate_tokens(new)
+        print(f"{name:<18}{len(old):>10}{len(new):>11}{old_tokens:>10}{new_tokens:>13}"
+              f"{1 - new_tokens / old_tokens:>8.0%}{micros:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Per-answer cost and writes: the old line pass-through against sse.reframe.
+
+The upstream stream is replayed from memory in network-sized reads, so only
+the framing work is measured.
+
+Run from the repository root:  python -m bench.sse
+"""
+import json
+import time
+import asyncio
+import sse
+
+
+TOKENS = 400
+READ_SIZE = 1024
+
+
+def upstream_body():
+    words = ('The **project** is <b>on track</b> and the next milestone is\n'
+             'the site visit with the client').split(' ')
+    frames = ''.join(
+        'data: ' + json.dumps({"choices": [{"delta": {"content": words[i % len(words)] + ' '}}]}) + '\n\n'
+        for i in range(TOKENS))
+    return (frames + 'data: [DONE]\n\n').encode()
+
+
+async def reads(body):
+    for i in range(0, len(body), READ_SIZE):
+        yield body[i:i + READ_SIZE]
+
+
+async def lines(body):
+    for line in body.decode().split('\n'):
+        yield line
+
+
+async def legacy_events(lines, project_id, lead_id, task_id):
+    # event_generator before sse.py: every upstream line is passed through
+    # and the id flags are checked on each one
+    projectId = leadId = taskId = True
+    async for chunk in lines:
+        if chunk:
+            yield f"{chunk.strip()}\n\n"
+            if project_id and task_id:
+                if taskId:
+                    yield f"data: task_id:{task_id}\n\n"
+                    taskId = False
+                if projectId:
+                    yield f"data: project_id:{project_id}\n\n"
+                    projectId = False
+            elif project_id:
+                if projectId:
+                    yield f"data: project_id:{project_id}\n\n"
+                    projectId = False
+            if lead_id:
+                if leadId:
+                    yield f"data: lead_id:{lead_id}\n\n"
+                    leadId = False
+
+
+async def run(make_events, rounds):
+    writes = size = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        writes = size = 0
+        async for event in make_events():
+            writes += 1
+            size += len(event)
+    return (time.perf_counter() - started) / rounds * 1e3, writes, size
+
+
+async def main():
+    body = upstream_body()
+    metadata = sse.metadata_events('P1', None, 'T1')
+    rounds = 200
+    results = [
+        ('line pass-through (old)', await run(lambda: legacy_events(lines(body), 'P1', None, 'T1'), rounds)),
+        ('sse.reframe', await run(lambda: sse.reframe(reads(body), metadata), rounds)),
+    ]
+    print(f"{TOKENS} tokens, {len(body)} bytes upstream in {READ_SIZE}-byte reads")
+    print(f"{'':<26}{'ms/answer':>10}{'writes':>8}{'bytes out':>11}")
+    for name, (ms, writes, size) in results:
+        print(f"{name:<26}{ms:>10.2f}{writes:>8}{size:>11}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
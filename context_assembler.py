@@ -0,0 +1,121 @@
+import os
+import asyncio
+import data_access
+from data_access import project_collection, lead_collection, task_collection
+from field_specs import PROJECT_SUMMARY, TASK_SUMMARY, LEAD_SUMMARY
+from single_flight import SingleFlight
+from prompt_format import estimate_tokens, format_value, serialize_context
+
+
+# Upper bound on the estimated tokens of the context put in the prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+
+# Lists that can be paged, with where they come from. Newest records are
+# ranked first; _id gives a stable order so pages never overlap.
+LIST_SOURCES = {
+    'projects': (project_collection, PROJECT_SUMMARY),
+    'tasks': (task_collection, TASK_SUMMARY),
+    'leads': (lead_collection, LEAD_SUMMARY),
+}
+RANK = [('_id', -1)]
+
+_pages = SingleFlight()
+
+
+def record_tokens(record):
+    # Cost of the record as one row of a prompt_format table
+    return estimate_tokens(' | '.join(format_value(v) for v in record.values()))
+
+
+def context_tokens(context):
+    return estimate_tokens(serialize_context(context))
+
+
+async def fetch_page(list_key, filter, offset=0, budget=PROMPT_TOKEN_BUDGET):
+    """Read ranked records until ``budget`` tokens are used.
+
+    Returns ``(records, next_offset)``; ``next_offset`` is None once the
+    list is exhausted. At least one record is returned if any is left.
+    Concurrent requests for the same page share one read.
+    """
+    key = (list_key, repr(filter), offset, budget)
+    return await _pages.do(key, lambda: _read_page(list_key, filter, offset, budget))
+
+
+async def _read_page(list_key, filter, offset, budget):
+    collection, spec = LIST_SOURCES[list_key]
+    records = []
+    used = 0
+    async for doc in data_access.stream(collection, filter, spec.projection, sort=RANK, skip=offset):
+        record = spec.shape(doc)
+        cost = record_tokens(record)
+        if records and used + cost > budget:
+            return records, offset + len(records)
+        records.append(record)
+        used += cost
+    return records, None
+
+
+async def fetch_pages(requests, budget=PROMPT_TOKEN_BUDGET):
+    """Fetch several lists concurrently, sharing ``budget`` between them.
+
+    ``requests`` maps list keys to ``{'filter': ..., 'offset': ...}``. Returns
+    the records and a cursor per list key; a cursor's ``offset`` is None once
+    its list has ended.
+    """
+    if not requests:
+        return {}, {}
+    share = budget // len(requests)
+    keys = list(requests)
+    results = await asyncio.gather(*(
+        fetch_page(key, requests[key]['filter'], requests[key].get('offset', 0), share)
+        for key in keys))
+    lists = {}
+    cursors = {}
+    for key, (records, next_offset) in zip(keys, results):
+        lists[key] = records
+        cursors[key] = {'filter': requests[key]['filter'],
+                        'start': requests[key].get('offset', 0), 'offset': next_offset}
+    return lists, cursors
+
+
+def page_note(list_key, cursor):
+    return (f"Showing {list_key} {cursor['start'] + 1}-{cursor['offset']}; "
+            f"more are available if the user asks for more {list_key}.")
+
+
+def fit_pages(context, cursors, budget=PROMPT_TOKEN_BUDGET):
+    """Trim ``context`` to ``budget`` and note where each paged list stopped.
+
+    ``cursors`` belong to the lists in ``context`` as fetched. A list cut
+    short by the trim continues from its first record that was not sent.
+    Returns the context and the cursors to store.
+    """
+    fetched = {key: len(context[key]) for key in cursors if key in context}
+    cursors = {key: cursor for key, cursor in cursors.items() if key in fetched}
+    context = dict(context)
+    # Every list might end up with a note; leave room for all of them
+    for key, cursor in cursors.items():
+        context[f'{key}_note'] = page_note(key, dict(cursor, offset=cursor['start'] + fetched[key]))
+    context = trim_to_budget(context, budget)
+    for key, cursor in cursors.items():
+        sent = len(context[key])
+        if sent < fetched[key]:
+            cursors[key] = cursor = dict(cursor, offset=cursor['start'] + sent)
+        if cursor['offset'] is None:
+            del context[f'{key}_note']
+        else:
+            context[f'{key}_note'] = page_note(key, cursor)
+    return context, cursors
+
+
+def trim_to_budget(context, budget=PROMPT_TOKEN_BUDGET):
+    """Halve the longest list in ``context`` until it fits ``budget``."""
+    while context_tokens(context) > budget:
+        lists = [k for k, v in context.items() if isinstance(v, list) and len(v) > 1]
+        if not lists:
+            break
+        longest = max(lists, key=lambda k: len(context[k]))
+        context = dict(context)
+        context[longest] = context[longest][:len(context[longest]) // 2]
+    return context
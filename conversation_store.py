@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+
+CONVERSATION_STORE = os.getenv('CONVERSATION_STORE', 'memory')
+CONVERSATION_DB_PATH = os.getenv('CONVERSATION_DB_PATH', 'conversations.db')
+CONVERSATION_TTL = float(os.getenv('CONVERSATION_TTL', '3600'))
+CONVERSATION_MAX_BYTES = int(os.getenv('CONVERSATION_MAX_BYTES', str(64 * 1024 * 1024)))
+CONVERSATION_MAX_ENTRY_BYTES = int(os.getenv('CONVERSATION_MAX_ENTRY_BYTES', str(256 * 1024)))
+# Seconds between updates of an entry's last-read time; reads inside the
+# window leave the row alone so they don't take the write lock
+CONVERSATION_TOUCH_INTERVAL = float(os.getenv('CONVERSATION_TOUCH_INTERVAL', '60'))
+CONVERSATION_THREADS = int(os.getenv('CONVERSATION_THREADS', '4'))
+
+# Store calls compress JSON and, for SQLite, can wait on another worker's
+# write lock, so they run on this pool instead of the event loop
+_executor = ThreadPoolExecutor(
+    max_workers=CONVERSATION_THREADS, thread_name_prefix='conversations')
+
+
+async def run(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    # ObjectId, Decimal128 and friends
+    return str(value)
+
+
+def encode(value):
+    return zlib.compress(json.dumps(value, default=_json_default, separators=(',', ':')).encode())
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def encode_capped(value, max_bytes):
+    """Encode ``value``, halving its longest list until it fits in ``max_bytes``.
+
+    Returns None when the value cannot be made small enough.
+    """
+    blob = encode(value)
+    while len(blob) > max_bytes and isinstance(value, dict):
+        lists = [k for k, v in value.items() if isinstance(v, list) and len(v) > 1]
+        if not lists:
+            return None
+        longest = max(lists, key=lambda k: len(value[k]))
+        value = dict(value)
+        value[longest] = value[longest][:len(value[longest]) // 2]
+        blob = encode(value)
+    return blob if len(blob) <= max_bytes else None
+
+
+class MemoryConversationStore:
+    """Per-process store: LRU over compressed entries with TTL and a byte budget."""
+
+    def __init__(self, max_bytes=CONVERSATION_MAX_BYTES, max_entry_bytes=CONVERSATION_MAX_ENTRY_BYTES,
+                 ttl=CONVERSATION_TTL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            blob, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+        return decode(blob)
+
+    def set(self, key, value):
+        blob = encode_capped(value, self.max_entry_bytes)
+        with self._lock:
+            self._remove(key)
+            if blob is None:
+                return
+            self._data[key] = (blob, time.monotonic() + self.ttl)
+            self.size += len(blob)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+class SQLiteConversationStore:
+    """Store shared by every worker on the host through one SQLite file."""
+
+    def __init__(self, path=CONVERSATION_DB_PATH, max_bytes=CONVERSATION_MAX_BYTES,
+                 max_entry_bytes=CONVERSATION_MAX_ENTRY_BYTES, ttl=CONVERSATION_TTL,
+                 touch_interval=CONVERSATION_TOUCH_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS conversations ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+            'expires REAL NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS conversations_accessed ON conversations (accessed)')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, accessed FROM conversations WHERE key = ? AND expires > ?',
+                (key, now)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.touch_interval:
+                # Eviction order only needs to be roughly right
+                self._conn.execute('UPDATE conversations SET accessed = ? WHERE key = ?', (now, key))
+        return decode(row[0])
+
+    def set(self, key, value):
+        blob = encode_capped(value, self.max_entry_bytes)
+        now = time.time()
+        with self._lock:
+            if blob is None:
+                self._conn.execute('DELETE FROM conversations WHERE key = ?', (key,))
+                return
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?)',
+                    (key, blob, len(blob), now + self.ttl, now))
+                self._conn.execute('DELETE FROM conversations WHERE expires <= ?', (now,))
+                self._evict()
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM conversations WHERE key = ?', (key,))
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM conversations').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used rows until the budget is met
+        excess = total - self.max_bytes
+        for key, size in self._conn.execute(
+                'SELECT key, size FROM conversations ORDER BY accessed').fetchall():
+            self._conn.execute('DELETE FROM conversations WHERE key = ?', (key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+
+def shutdown():
+    _executor.shutdown(wait=False)
+
+
+def from_env():
+    if CONVERSATION_STORE == 'sqlite':
+        return SQLiteConversationStore()
+    return MemoryConversationStore()
@@ -0,0 +1,104 @@
+import os
+import asyncio
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+import metrics
+from single_flight import SingleFlight
+
+
+MONGODB_URI = os.getenv('MONGODB_URI')
+DATABASE_NAME = os.getenv('DATABASE_NAME')
+
+# pymongo is synchronous, so every call runs on this bounded pool instead of
+# the event loop. Keep it at or below the driver's maxPoolSize.
+MONGO_THREADS = int(os.getenv('MONGO_THREADS', '16'))
+# Documents pulled from a cursor per thread-pool hop
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', '200'))
+# $lookup with both localField/foreignField and a pipeline needs MongoDB 5.0.
+# Set to 0 on older servers (and for mongomock) to join whole user documents
+# and trim them afterwards instead.
+MONGO_LOOKUP_PIPELINE = os.getenv('MONGO_LOOKUP_PIPELINE', '1') == '1'
+
+client = MongoClient(MONGODB_URI, maxPoolSize=max(MONGO_THREADS, 1))
+db = client[DATABASE_NAME]
+project_collection = "project"
+lead_collection = "Lead"
+user_collection = "users"
+org_collection = "organisation"
+task_collection = "task"
+
+_executor = ThreadPoolExecutor(
+    max_workers=MONGO_THREADS, thread_name_prefix='mongo')
+# Identical reads issued by concurrent requests share one round trip; the
+# documents returned are shared too and must not be modified.
+_reads = SingleFlight()
+
+
+async def run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+
+
+async def find_one(collection, filter, projection=None):
+    key = ('find_one', collection, repr(filter), repr(projection))
+    return await _reads.do(key, lambda: metrics.timed_query(
+        'find_one', collection, lambda: run(db[collection].find_one, filter, projection)))
+
+
+async def stream(collection, filter, projection=None, sort=None, skip=0, batch_size=MONGO_BATCH_SIZE):
+    cursor = db[collection].find(filter, projection, sort=sort, skip=skip, batch_size=batch_size)
+
+    async def next_batch():
+        return await run(lambda: list(islice(cursor, batch_size)))
+    try:
+        while True:
+            # Each batch is timed on its own; the time the caller spends
+            # between batches is not Mongo's
+            batch = await metrics.timed_query('stream', collection, next_batch)
+            for doc in batch:
+                yield doc
+            if len(batch) < batch_size:
+                break
+    finally:
+        await run(cursor.close)
+
+
+async def find_one_with_assignees(collection, filter, id_field, assignee_field, org_id):
+    """Fetch one entity and the users assigned to it in a single round trip.
+
+    ``assignees`` on the returned document holds ``{'_id', 'username'}`` for
+    every user of ``org_id`` whose ``assignee_field`` contains the entity id.
+    """
+    lookup = {
+        'from': user_collection,
+        'localField': id_field,
+        'foreignField': assignee_field,
+        'as': 'assignees',
+    }
+    if MONGO_LOOKUP_PIPELINE:
+        # The join stays on the indexed assignment path; only the org's users
+        # and only their names come back from it
+        lookup['pipeline'] = [{'$match': {'organization': org_id}}, {'$project': {'username': 1}}]
+        trim = []
+    else:
+        # Whole user documents are joined, then cut down to the same shape
+        trim = [{'$addFields': {'assignees': {'$map': {
+            'input': {'$filter': {
+                'input': '$assignees',
+                'as': 'user',
+                'cond': {'$eq': ['$$user.organization', org_id]},
+            }},
+            'as': 'user',
+            'in': {'_id': '$$user._id', 'username': '$$user.username'},
+        }}}}]
+    pipeline = [{'$match': filter}, {'$limit': 1}, {'$lookup': lookup}] + trim
+    key = ('with_assignees', collection, repr(filter), id_field, assignee_field, org_id)
+    docs = await _reads.do(key, lambda: metrics.timed_query(
+        'aggregate', collection, lambda: run(lambda: list(db[collection].aggregate(pipeline)))))
+    return docs[0] if docs else None
+
+
+def shutdown():
+    _executor.shutdown(wait=False)
+    client.close()
@@ -0,0 +1,299 @@
+import os
+import re
+import asyncio
+import time
+import threading
+from collections import deque
+import data_access
+import metrics
+from data_access import (project_collection, lead_collection, user_collection,
+                         task_collection)
+from single_flight import SingleFlight
+from ttl_cache import TTLCache
+
+
+# A full rebuild per org after this many seconds catches anything the
+# incremental updates missed. The old index keeps serving until it is done.
+ENTITY_INDEX_TTL = float(os.getenv('ENTITY_INDEX_TTL', '600'))
+ENTITY_INDEX_ORGS = int(os.getenv('ENTITY_INDEX_ORGS', '500'))
+# Tail Mongo change streams (needs a replica set) to update indexes live
+ENTITY_INDEX_WATCH = os.getenv('ENTITY_INDEX_WATCH', '0') == '1'
+# Longest a burst of changes waits before searches see it
+ENTITY_INDEX_REFRESH = float(os.getenv('ENTITY_INDEX_REFRESH', '1'))
+
+# kind -> (collection, name field, id fields, org field)
+SOURCES = {
+    'project': (project_collection, 'project_name', ('project_id',), 'org_id'),
+    'lead': (lead_collection, 'name', ('lead_id',), 'org_id'),
+    'task': (task_collection, 'task_name', ('project_id', 'task_id'), 'org_id'),
+    'user': (user_collection, 'username', ('_id',), 'organization'),
+}
+_COLLECTION_KINDS = {source[0]: kind for kind, source in SOURCES.items()}
+
+_spaces = re.compile(r'\s+')
+
+
+def normalize(text):
+    return _spaces.sub(' ', text.strip().lower())
+
+
+class Automaton:
+    """Trie of whole-word terms for Aho-Corasick matching.
+
+    Terms can be added and removed at any time; ``compile`` turns the
+    current terms into a Matcher, which never changes afterwards.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._terms = [[]]
+
+    def add(self, term, value):
+        node = 0
+        for char in term:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._terms.append([])
+            node = next_node
+        self._terms[node].append((len(term), value))
+
+    def remove(self, term, value):
+        node = 0
+        for char in term:
+            node = self._goto[node].get(char)
+            if node is None:
+                return False
+        terms = self._terms[node]
+        if (len(term), value) in terms:
+            terms.remove((len(term), value))
+            return True
+        return False
+
+    def compile(self):
+        goto = [dict(edges) for edges in self._goto]
+        fail = [0] * len(goto)
+        out = [list(terms) for terms in self._terms]
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                link = fail[node]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                fail[child] = goto[link].get(char, 0)
+                out[child] += out[fail[child]]
+                queue.append(child)
+        return Matcher(goto, fail, out)
+
+
+class Matcher:
+    """A compiled Automaton; safe to search while the trie keeps changing."""
+
+    def __init__(self, goto=None, fail=None, out=None):
+        self._goto = goto or [{}]
+        self._fail = fail or [0]
+        self._out = out or [[]]
+
+    def search(self, text):
+        """Yield ``(start, end, value)`` for every whole-word term in ``text``."""
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._out[node]:
+                start = i - length + 1
+                end = i + 1
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (end == len(text) or not text[end].isalnum()):
+                    yield start, end, value
+
+
+class OrgIndex:
+    """Names of one org's projects, leads, tasks and users, resolvable to ids.
+
+    Changes go to the trie; searches use the last compiled matcher until
+    ``refresh`` swaps in a new one, so ``find`` never compiles.
+    """
+
+    def __init__(self):
+        self.automaton = Automaton()
+        self.matcher = Matcher()
+        self.dirty = False
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, kind, doc):
+        source = SOURCES[kind]
+        name = doc.get(source[1])
+        if not isinstance(name, str) or not name.strip():
+            return False
+        entry = (kind, name, tuple(str(doc.get(field)) for field in source[2]))
+        with self._lock:
+            if self._docs.get(doc['_id']) == entry:
+                # Most updates touch other fields; the name is unchanged
+                return False
+            self._remove(doc['_id'])
+            self._docs[doc['_id']] = entry
+            self.automaton.add(normalize(name), entry)
+            self.dirty = True
+        return True
+
+    def delete(self, doc_id):
+        with self._lock:
+            return self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return False
+        self.automaton.remove(normalize(entry[1]), entry)
+        self.dirty = True
+        return True
+
+    def refresh(self):
+        """Compile pending changes into a new matcher; blocking, run off the loop."""
+        with self._lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.matcher = self.automaton.compile()
+
+    def find(self, text):
+        """Return ``{kind: [(name, ids), ...]}`` for the names mentioned in ``text``.
+
+        Overlapping mentions keep the longest one, so "Alpha Tower" wins over
+        "Alpha" and a project name inside a longer lead name is not reported.
+        """
+        matches = list(self.matcher.search(normalize(text)))
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        mentions = {}
+        chosen = None
+        for start, end, entry in matches:
+            # Entries with exactly the chosen span (a project and a lead with
+            # the same name, say) are all kept
+            if chosen is None or start >= chosen[1]:
+                chosen = (start, end)
+            elif (start, end) != chosen:
+                continue
+            kind, name, ids = entry
+            mentions.setdefault(kind, []).append((name, ids))
+        return mentions
+
+
+_indexes = TTLCache(ENTITY_INDEX_ORGS, ENTITY_INDEX_TTL)
+_builds = SingleFlight()
+# Background rebuilds of expired indexes, by org
+_rebuilds = {}
+
+
+async def _build(org_id):
+    index = OrgIndex()
+    for kind, (collection, name_field, id_fields, org_field) in SOURCES.items():
+        projection = {name_field: 1}
+        projection.update({field: 1 for field in id_fields})
+        async for doc in data_access.stream(collection, {org_field: org_id}, projection):
+            index.upsert(kind, doc)
+    await data_access.run(index.refresh)
+    _indexes.set(org_id, index)
+    return index
+
+
+async def get(org_id):
+    """The org's index; an expired one is served while it is rebuilt."""
+    cached = _indexes.get_stale(org_id)
+    if cached is None:
+        return await _builds.do(org_id, lambda: _build(org_id))
+    index, fresh = cached
+    if not fresh and org_id not in _rebuilds:
+        _rebuilds[org_id] = asyncio.ensure_future(_rebuild(org_id))
+    return index
+
+
+async def _rebuild(org_id):
+    try:
+        await _builds.do(org_id, lambda: _build(org_id))
+    except Exception as e:
+        # The expired index stays; the next request tries again
+        metrics.log('entity_index_build_failed', 'error', org_id=org_id, error=repr(e))
+    finally:
+        _rebuilds.pop(org_id, None)
+
+
+def invalidate(org_id):
+    _indexes.pop(org_id)
+
+
+def pick(mentions, kind, slot_text, project_id=None):
+    """The known name of ``kind`` mentioned inside ``slot_text``, with its ids.
+
+    ``slot_text`` is what the intent parser captured after "of project" and
+    so on; it often runs past the name ("Alpha for user Bob"). Tasks can be
+    limited to one project.
+    """
+    if not slot_text:
+        return None
+    slot = normalize(slot_text)
+    for name, ids in mentions.get(kind, []):
+        if kind == 'task' and project_id is not None and ids[0] != project_id:
+            continue
+        if re.search(r'(?<!\w)' + re.escape(normalize(name)) + r'(?!\w)', slot):
+            return name, ids
+    return None
+
+
+def apply_change(collection, change):
+    """Apply one change stream event; returns the org indexes it changed."""
+    kind = _COLLECTION_KINDS.get(collection)
+    if kind is None:
+        return []
+    operation = change.get('operationType')
+    doc_id = change.get('documentKey', {}).get('_id')
+    if operation == 'delete':
+        return [index for index in _indexes.values(stale=True) if index.delete(doc_id)]
+    doc = change.get('fullDocument')
+    if not doc:
+        return []
+    # Expired indexes are still being served
+    cached = _indexes.get_stale(str(doc.get(SOURCES[kind][3])))
+    if cached is not None and cached[0].upsert(kind, doc):
+        return [cached[0]]
+    return []
+
+
+def watch(stop):
+    """Tail the entity collections until ``stop`` is set; run in a thread.
+
+    Changed indexes are recompiled here once the stream goes quiet, or at
+    least every ENTITY_INDEX_REFRESH seconds while it stays busy.
+    """
+    pipeline = [{'$match': {'ns.coll': {'$in': list(_COLLECTION_KINDS)}}}]
+    changed = {}
+    since = None
+    try:
+        with data_access.db.watch(pipeline, full_document='updateLookup') as stream:
+            while not stop.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    for index in apply_change(change['ns']['coll'], change):
+                        changed[id(index)] = index
+                        since = since or time.monotonic()
+                if changed and (change is None or time.monotonic() - since >= ENTITY_INDEX_REFRESH):
+                    for index in changed.values():
+                        index.refresh()
+                    changed.clear()
+                    since = None
+                if change is None:
+                    time.sleep(0.5)
+    except Exception as e:
+        metrics.log('entity_watch_stopped', 'error', error=repr(e))
+
+
+def start_watch():
+    stop = threading.Event()
+    if ENTITY_INDEX_WATCH:
+        threading.Thread(target=watch, args=(stop,), name='entity-watch', daemon=True).start()
+    return stop
@@ -0,0 +1,45 @@
+class FieldSpec:
+    """Declares which fields of an entity the prompt context needs.
+
+    ``fields`` maps output keys to document fields and becomes an inclusion
+    projection; ``exclude`` lists fields to drop and becomes an exclusion
+    projection. Either way the projection is pushed down to Mongo so unused
+    fields never leave the server, and ``shape`` gives the context dict.
+    """
+
+    def __init__(self, fields=None, exclude=None):
+        self.fields = fields
+        self.exclude = exclude
+        if fields is not None:
+            self.projection = {'_id': 0}
+            self.projection.update({source: 1 for source in fields.values()})
+        else:
+            self.projection = {key: 0 for key in exclude}
+
+    def shape(self, doc):
+        if self.fields is not None:
+            return {key: doc.get(source) for key, source in self.fields.items()}
+        return {k: v for k, v in doc.items() if k not in self.exclude}
+
+
+PROJECT_SUMMARY = FieldSpec(fields={
+    'project_name': 'project_name',
+    'client_info': 'client',
+    'phase': 'project_status',
+})
+
+TASK_SUMMARY = FieldSpec(fields={
+    'task_name': 'task_name',
+    'task_assignee': 'task_assignee',
+    'reporter': 'reporter',
+    'task_status': 'task_status',
+    'task_priority': 'task_priority',
+    'task_createdOn': 'task_createdOn',
+    'estimated_task_start_date': 'estimated_task_start_date',
+    'estimated_task_end_date': 'estimated_task_end_date',
+})
+
+LEAD_SUMMARY = FieldSpec(exclude=['_id', 'lead_id', 'org_id', 'fileId'])
+
+USER_PROFILE = FieldSpec(exclude=[
+    '_id', 'org_id', 'organization', 'password', 'data', 'refreshToken', 'userProfile'])
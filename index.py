@@ -1,41 +1,56 @@
 import os
-import re
-import requests
+import json
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import asyncio
-from pymongo import MongoClient
+import functools
+from typing import List, Optional
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from bson import ObjectId
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-
-def clean_response_text(text):
-    clean_text = re.sub(r'\*+', '', text)
-    clean_text = re.sub(r'\<.*?\>', '', clean_text)
-    clean_text = clean_text.replace('\n', ' ')
-    clean_text = clean_text.strip()
-    return clean_text
+# The modules below read their settings from the env loaded above
+import llm_client
+import data_access
+import auth_cache
+import indexes
+import conversation_store
+import context_assembler
+import intent
+import entity_index
+import prompt_format
+import response_cache
+import single_flight
+import query_planner
+import upstream_gateway
+import sse
+import metrics
 
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-MONGODB_URI = os.getenv('MONGODB_URI')
-TOKEN = os.getenv('TOKEN')
-DATABASE_NAME = os.getenv('DATABASE_NAME')
+# Questions per /query/batch request, and how many of them stream at once
+BATCH_MAX_QUESTIONS = int(os.getenv('BATCH_MAX_QUESTIONS', '20'))
+BATCH_FANOUT = int(os.getenv('BATCH_FANOUT', '4'))
 
-client = MongoClient(MONGODB_URI)
-db = client[DATABASE_NAME]
-project_collection = "project"
-lead_collection = "Lead"
-user_collection = "users"
-org_collection = "organisation"
-task_collection = "task"
 
+conversations = conversation_store.from_env()
+answer_flights = single_flight.StreamGroup()
 
-conversation_history = {}
+metrics.Gauge('chatbot_response_cache_hits_total', 'Answer cache hits',
+              lambda: response_cache.stats()['hits'], kind='counter')
+metrics.Gauge('chatbot_response_cache_misses_total', 'Answer cache misses',
+              lambda: response_cache.stats()['misses'], kind='counter')
+metrics.Gauge('chatbot_response_cache_entries', 'Answers in the cache',
+              lambda: response_cache.stats()['entries'])
+metrics.Gauge('chatbot_upstream_active', 'LLM calls streaming now',
+              lambda: upstream_gateway.stats()['active'])
+metrics.Gauge('chatbot_upstream_waiting', 'Requests waiting for an LLM slot',
+              lambda: upstream_gateway.stats()['waiting'])
+metrics.Gauge('chatbot_upstream_breaker_open', '1 while the LLM circuit breaker refuses calls',
+              lambda: int(upstream_gateway.stats()['breaker'] == 'open'))
 
 
 class QueryRequest(BaseModel):
@@ -44,7 +59,33 @@ class QueryRequest(BaseModel):
     user_id: str
 
 
-app = FastAPI()
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    org_id: str
+    user_id: str
+
+
+class CacheInvalidateRequest(BaseModel):
+    org_id: str
+    user_id: Optional[str] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    llm_client.get_client()
+    stop_watch = entity_index.start_watch()
+    try:
+        await data_access.run(indexes.ensure_indexes)
+    except Exception as e:
+        metrics.log('index_check_failed', 'error', error=repr(e))
+    yield
+    stop_watch.set()
+    await llm_client.close_client()
+    data_access.shutdown()
+    conversation_store.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -54,397 +95,324 @@ app.add_middleware(
 )
 
 
-@app.post("/query/")
-async def query_rag_system(request: QueryRequest):
-    try:
-        context = {}
-        org_id = request.org_id
-        user_id = request.user_id
-        project_id = None
-        lead_id = None
-        task_id = None
-
-        casual_greetings = ["Hello", "hello", "Hi", "hi", "hey", "greetings",
-                            "good morning", "good afternoon", "good evening", "good day", "hey there"]
-
-        # If the user's question contains any casual greeting
-        if any(greeting in request.question.lower() for greeting in casual_greetings):
+GREETING_CONTEXT = {
+    "role": "system",
+    "content": "You are a helpful assistant that provides information about projects, leads, and tasks in a company crm management system. You will respond in a concise and clear manner."
+}
+
+
+async def check_identity(org_id, user_id):
+    """Return the org, the user and the org's entity index, or raise 404."""
+    check_org, check_user = await asyncio.gather(
+        auth_cache.get_org(org_id), auth_cache.get_user(user_id, org_id))
+
+    # Check organisation
+    if not check_org:
+        raise HTTPException(
+            status_code=404, detail="Organisation not found")
+
+    # Check user
+    if not check_user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Unknown callers never get an org's names indexed
+    entities = await entity_index.get(org_id)
+    return check_org, check_user, entities
+
+
+def stored_reader(user_id):
+    """Read the user's stored context and page positions at most once each.
+
+    Every question of a request sees what was stored before it began.
+    """
+    reads = {}
+
+    def read(suffix=''):
+        if suffix not in reads:
+            reads[suffix] = asyncio.ensure_future(
+                conversation_store.run(conversations.get, f"{user_id}{suffix}"))
+        return reads[suffix]
+    return read
+
+
+async def build_context(parsed, role, org_id, user_id, check_org, entities, plan, stored):
+    """Context for one question, the ids sent back as metadata events and the
+    page positions to store with it (None leaves the stored ones alone).
+
+    Nothing is stored here; ``save_context`` does that once the request's
+    contexts are built.
+    """
+    context = {}
+    # If the user's question contains any casual greeting
+    if parsed.greeting:
+        context = dict(GREETING_CONTEXT)
+
+    # "next page" / "more leads" continue the lists of the previous answer
+    page_request = parsed.page_request
+    untouched = {}
+    if page_request is not None:
+        project_id = lead_id = task_id = cursors = None
+        saved = await stored(':pages') or {}
+        next_pages = {key: cursor for key, cursor in saved.items()
+                      if cursor['offset'] is not None and (not page_request or key in page_request)}
+        if next_pages:
+            lists, cursors = await context_assembler.fetch_pages(next_pages)
+            context.update(lists)
+            # "more leads" leaves the saved projects where they were
+            untouched = {key: cursor for key, cursor in saved.items() if key not in next_pages}
+        else:
+            # Ended lists are not sent again, and neither is the last answer
+            lists = ' or '.join(page_request or saved) or 'records'
+            context['message'] = f"There are no more {lists} to show."
+    else:
+        result = await query_planner.execute(
+            parsed, role, org_id, user_id, check_org, entities, plan)
+        context.update(result.context)
+        project_id, lead_id, task_id = result.project_id, result.lead_id, result.task_id
+        cursors = result.cursors
+
+    if not context:  # If no specific conditions match, use the context from the last answer
+        previous_answer = await stored()
+        if previous_answer:
+            # Shared by the questions of a batch; each gets its own copy
+            context = dict(previous_answer)
+        else:
             context = {
+                'message': "No specific project, lead, or task found. Here is the context from previous answer."}
+    if cursors is not None:
+        context, cursors = context_assembler.fit_pages(context, cursors)
+        cursors = {**untouched, **cursors}
+    else:
+        context = context_assembler.trim_to_budget(context)
+    return context, project_id, lead_id, task_id, cursors
+
+
+async def save_context(user_id, context, cursors):
+    """Store the context follow-up questions fall back on, and the page positions."""
+    if cursors is not None:
+        await conversation_store.run(conversations.set, f"{user_id}:pages", cursors)
+    await conversation_store.run(conversations.set, user_id, context)
+
+
+def answer_events(question, role, org_id, context, project_id, lead_id, task_id):
+    """SSE events answering ``question`` from ``context``."""
+    with metrics.stage('serialize'):
+        prompt_context = prompt_format.serialize_context(context)
+    metrics.context_chars.observe(len(prompt_context))
+    cache_key = response_cache.make_key(
+        question, role, prompt_context, (project_id, lead_id, task_id))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return response_cache.replay(cached)
+
+    # Prepare the request to the Gemini API
+    # gemini_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent'
+    data = {
+
+        "model": "meta-llama/Meta-Llama-3.1-8B-Instruct",
+        "messages": [
+            {
                 "role": "system",
-                "content": "You are a helpful assistant that provides information about projects, leads, and tasks in a company crm management system. You will respond in a concise and clear manner."
+                "content": "You are a helpful assistant that provides accurate answers to questions based on the provided context. Never send the details directly in the response. Always summarize or provide relevant information as needed, without raw data."
+            },
+            {
+                "role": "user",
+                "content": f"Summarize the following details '{question}' and the info:\n{prompt_context}",
             }
+        ],
+        "max_tokens": 5000,
+        "temperature": 0.7,
+        # "stream": False,
+        "stream": True
 
-        # Check organisation
-        check_org = db[org_collection].find_one({"_id": ObjectId(org_id)})
-        if not check_org:
-            raise HTTPException(
-                status_code=404, detail="Organisation not found")
+    }
 
-        # Check user
-        check_user = db[user_collection].find_one(
-            {"_id": ObjectId(user_id), "organization": org_id})
-        if not check_user:
-            raise HTTPException(status_code=404, detail="User not found")
+    async def upstream_events():
+        # Call the Gemini API; error statuses raise instead of being streamed
+        call = await upstream_gateway.open_call(org_id, data)
+        # Metadata goes out with the first upstream read, ahead of its token,
+        # so a call that fails before then still becomes the HTTP status
+        events = response_cache.recording(cache_key, sse.reframe(
+            call.chunks(), sse.metadata_events(project_id, lead_id, task_id)))
+        async for event in events:
+            yield event
 
-        # Check for project name, lead name, and user name in the request
+    # Identical questions asked at the same time share one upstream call
+    return answer_flights.subscribe(f"{org_id}:{cache_key}", upstream_events)
 
-        if any(phrase in request.question.lower() for phrase in ["entire projects", "all projects", "whole projects", "all project"]):
-            project_id = '00000000000'
-        else:
-            match = re.search(
-                r' of project ([\w\s]+)', request.question, re.IGNORECASE)
-            project_name = match.group(1) if match else None
 
-        if any(phrase in request.question.lower() for phrase in ["entire leads", "all leads",  "all lead", "whole leads"]):
-            lead_id = '111111'
-        else:
-            match = re.search(r'of lead ([\w\s]+)',
-                              request.question, re.IGNORECASE)
-            lead_name = match.group(1) if match else None
+async def primed(events):
+    """Wait for the first event, so a failed upstream call becomes the HTTP status.
+
+    Errors after that are sent as an ``error`` event; the status is gone by then.
+    """
+    try:
+        first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def stream():
+        try:
+            if first is not None:
+                yield first
+            async for event in events:
+                yield event
+        except upstream_gateway.GatewayError as e:
+            metrics.log('stream_failed', 'error', error=str(e))
+            yield f"event: error\ndata: {e}\n\n"
+    return stream()
+
+
+def response_headers(plan, timings):
+    headers = {'Server-Timing': metrics.server_timing(timings)}
+    if query_planner.QUERY_PLAN_DEBUG:
+        headers['X-Query-Plan'] = json.dumps(plan.timings())
+        metrics.log('query_plan', steps=plan.timings())
+    return headers
 
-        if any(phrase in request.question.lower() for phrase in ["entire tasks", "all tasks", "all task", "whole tasks"]):
-            task_id = '222222222'
-        else:
-            match = re.search(r'task\s+([a-zA-Z\s]+?)(?=\s+of|\s*$)',
-                              request.question, re.IGNORECASE)
-            task_name = match.group(1).strip() if match else None
 
-        match = re.search(r'user ([\w\s]+)', request.question, re.IGNORECASE)
-        user_name = match.group(1) if match else None
-        # Check user role
+@app.post("/query/")
+async def query_rag_system(request: QueryRequest):
+    timings = metrics.begin_request()
+    status = 500
+    try:
+        org_id = request.org_id
+        user_id = request.user_id
+        with metrics.stage('intent'):
+            parsed = intent.parse(request.question)
+        with metrics.stage('identity'):
+            check_org, check_user, entities = await check_identity(org_id, user_id)
         role = check_user.get('role')
-        if role in ['ADMIN', 'SUPERADMIN']:
-            # Handle projects
-            if project_id == '00000000000':
-                projects = list(
-                    db[project_collection].find({"org_id": org_id}))
-                project_list = [
-                    {
-                        'project_name': project.get('project_name'),
-                        'client_info': project.get('client'),
-                        'phase': project.get('project_status'),
-                    }
-                    for project in projects
-                ]
-                context['projects'] = project_list
-            else:
-                if task_id == '222222222':
-                    if project_name:
-                        project_details = db[project_collection].find_one(
-                            {"project_name": project_name, "org_id": org_id})
-                        if project_details:
-                            project_id = project_details.get("project_id")
-                            tasks = list(
-                                db[task_collection].find({"project_id": project_id}))
-                            task_list = [
-                                {
-                                    'task_name': task.get('task_name'),
-                                    'task_assignee': task.get('task_assignee'),
-                                    'reporter': task.get('reporter'),
-                                    'task_status': task.get('task_status'),
-                                    'task_priority': task.get('task_priority'),
-                                    'task_createdOn': task.get('task_createdOn'),
-                                    'estimated_task_start_date': task.get('estimated_task_start_date'),
-                                    'estimated_task_end_date': task.get('estimated_task_end_date'),
-                                }
-                                for task in tasks
-                            ]
-                            context['tasks'] = task_list
-                        else:
-                            context = {"message": "project not found"}
-                    else:
-                        context = {"message": "project not found"}
-
-                elif project_name and task_name:
-                    project_details = db[project_collection].find_one(
-                        {"project_name": project_name, "org_id": org_id})
-
-                    if project_details:
-                        project_id = project_details.get("project_id")
-
-                        task_details = db[task_collection].find_one(
-                            {"project_id": project_id, "task_name": task_name})
-                        print(task_details)
-                        if task_details:
-                            task_id = task_details.get("task_id")
-                            # task_info = {k: v for k, v in task_details.items(
-                            # ) if k not in ['_id', 'task_id', 'org_id', 'fileId']}
-                            context.update(task_details)
-                        else:
-                            context = {"message": "task not found"}
-
-                    else:
-                        context = {"message": "project not found"}
-                elif project_name:
-                    project_details = db[project_collection].find_one(
-                        {"project_name": project_name, "org_id": org_id})
-                    if project_details:
-                        project_id = project_details.get("project_id")
-                        project_info = {k: v for k, v in project_details.items(
-                        ) if k not in ['_id', 'project_id', 'org_id', 'fileId']}
-                        project_info['assignees'] = [assignee['username'] for assignee in db[user_collection].find(
-                            {'data.projectData.project_id': project_details.get('project_id'), "organization": org_id})]
-                        context.update(project_info)
-                    else:
-                        context = {"message": "project not found"}
-
-            # Handle leads
-            if lead_id == '111111':
-                leads = list(db[lead_collection].find({"org_id": org_id}))
-                lead_list = [
-                    {k: v for k, v in lead.items() if k not in [
-                        '_id', 'lead_id', 'org_id', 'fileId']}
-                    for lead in leads
-                ]
-                context['leads'] = lead_list
-            else:
-                if lead_name:
-                    lead_details = db[lead_collection].find_one(
-                        {"name": lead_name, "org_id": org_id})
-                    if lead_details:
-                        lead_id = lead_details.get("lead_id")
-                        lead_info = {k: v for k, v in lead_details.items() if k not in [
-                            '_id', 'lead_id', 'org_id']}
-                        lead_info['assignees'] = [assignee['username'] for assignee in db[user_collection].find(
-                            {'data.leadData.lead_id': lead_details.get('lead_id'), "organization": org_id})]
-                        context.update(lead_info)
-                    else:
-                        context = {"message": "lead not found."}
-            if user_name:
-                user_details = db[user_collection].find_one(
-                    {"username": user_name, "organization": org_id})
-                if user_details:
-                    user_info = {k: v for k, v in user_details.items() if k not in [
-                        '_id', 'org_id', 'organization', 'password', 'data', 'refreshToken', 'userProfile']}
-                    org_details = db[org_collection].find_one(
-                        {"_id": ObjectId(org_id)})
-                    if org_details:
-                        user_info['organisation_name'] = org_details.get(
-                            'organization')
-                    context.update(user_info)
-                else:
-                    raise HTTPException(
-                        status_code=404, detail="User not found.")
-
-        elif role in ['Senior Architect']:
-            # Similar logic as above for Senior Architect
-            if project_id == '00000000000':
-                projects = list(
-                    db[project_collection].find({"org_id": org_id}))
-                project_list = [
-                    {
-                        'project_name': project.get('project_name'),
-                        'client_info': project.get('client'),
-                        'phase': project.get('project_status'),
-                    }
-                    for project in projects
-                ]
-                context['projects'] = project_list
-            else:
-                if project_name:
-                    project_details = db[project_collection].find_one(
-                        {"project_name": project_name, "org_id": org_id})
-                    if project_details:
-                        project_id = project_details.get("project_id")
-                        project_info = {k: v for k, v in project_details.items(
-                        ) if k not in ['_id', 'project_id', 'org_id', 'fileId']}
-                        project_info['assignees'] = [assignee['username'] for assignee in db[user_collection].find(
-                            {'data.projectData.project_id': project_details.get('project_id'), "organization": org_id})]
-                        context.update(project_info)
-                    else:
-                        context = {"message": "Project not found."}
-
-            # Handle leads
-            if lead_id == '111111':
-                leads = list(db[lead_collection].find({"org_id": org_id}))
-                lead_list = [
-                    {k: v for k, v in lead.items() if k not in [
-                        '_id', 'lead_id', 'org_id', 'fileId']}
-                    for lead in leads
-                ]
-                context['leads'] = lead_list
+        plan = query_planner.Plan()
+        with metrics.stage('context'):
+            context, project_id, lead_id, task_id, cursors = await build_context(
+                parsed, role, org_id, user_id, check_org, entities, plan, stored_reader(user_id))
+            await save_context(user_id, context, cursors)
+        # Serializing, the cache lookup and the LLM call up to its first event
+        with metrics.stage('first_event'):
+            events = await primed(answer_events(request.question, role, org_id, context,
+                                                project_id, lead_id, task_id))
+        status = 200
+        return StreamingResponse(metrics.counting(events, '/query/', timings),
+                                 media_type="text/event-stream", headers=response_headers(plan, timings))
+
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except upstream_gateway.GatewayError as e:
+        status = e.status_code
+        metrics.log('query_failed', 'warning', endpoint='/query/', status=status, error=str(e))
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        metrics.log('query_failed', 'error', endpoint='/query/', status=status, error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        metrics.requests.inc('/query/', str(status))
+
+
+async def multiplex(streams):
+    """Interleave several event streams, tagging each event with its stream id.
+
+    ``streams`` pairs ids with functions that start a stream. At most
+    BATCH_FANOUT streams are started at once; the others wait their turn.
+    """
+    queue = asyncio.Queue()
+    fanout = asyncio.Semaphore(BATCH_FANOUT)
+
+    async def pump(qid, start):
+        try:
+            async with fanout:
+                async for event in start():
+                    # One write can hold several frames; tag each of them
+                    await queue.put(''.join(f"id: {qid}\n{frame}\n\n"
+                                            for frame in event.split('\n\n') if frame))
+        except Exception as e:
+            metrics.log('stream_failed', 'error', question=qid, error=str(e))
+            await queue.put(f"id: {qid}\nevent: error\ndata: {e}\n\n")
+        finally:
+            await queue.put(None)
+
+    pumps = [asyncio.ensure_future(pump(qid, start)) for qid, start in streams]
+    try:
+        remaining = len(pumps)
+        while remaining:
+            event = await queue.get()
+            if event is None:
+                remaining -= 1
             else:
-                if lead_name:
-                    lead_details = db[lead_collection].find_one(
-                        {"name": lead_name, "org_id": org_id})
-                    if lead_details:
-                        lead_id = lead_details.get("lead_id")
-                        lead_info = {k: v for k, v in lead_details.items() if k not in [
-                            '_id', 'lead_id', 'org_id']}
-                        lead_info['assignees'] = [assignee['username'] for assignee in db[user_collection].find(
-                            {'data.leadData.lead_id': lead_details.get('lead_id'), "organization": org_id})]
-                        context.update(lead_info)
-                    else:
-                        context = {"message": "lead not found."}
-            if task_id == '222222222':
-                if project_name:
-                    project_details = db[project_collection].find_one(
-                        {"project_name": project_name, "org_id": org_id})
-                    if project_details:
-                        project_id = project_details.get("project_id")
-                        tasks = list(
-                            db[task_collection].find({"project_id": project_id}))
-                        task_list = [
-                            {
-                                'task_name': task.get('task_name'),
-                                'task_assignee': task.get('task_assignee'),
-                                'reporter': task.get('reporter'),
-                                'task_status': task.get('task_status'),
-                                'task_priority': task.get('task_priority'),
-                                'task_createdOn': task.get('task_createdOn'),
-                                'estimated_task_start_date': task.get('estimated_task_start_date'),
-                                'estimated_task_end_date': task.get('estimated_task_end_date'),
-                            }
-                            for task in tasks
-                        ]
-                        context['tasks'] = task_list
-                    else:
-                        context = {"message": "project not found"}
-                else:
-                    context = {"message": "project not found"}
+                yield event
+    finally:
+        for task in pumps:
+            task.cancel()
 
-        else:
-            # For other roles, check access
-
-            find_project = db[project_collection].find_one(
-                {"project_name": project_name, "org_id": org_id})
-            find_lead = db[lead_collection].find_one(
-                {"name": lead_name, "org_id": org_id})
-            if find_project:
-                project_id = find_project.get("project_id")
-                check_user_access = db[user_collection].find_one({"_id": ObjectId(
-                    user_id), "organization": org_id, "data.projectData.project_id": project_id})
-                if check_user_access:
-                    if task_id == '222222222':
-                        if project_name:
-                            project_details = db[project_collection].find_one(
-                                {"project_name": project_name, "org_id": org_id})
-                            if project_details:
-                                project_id = project_details.get("project_id")
-                                tasks = list(
-                                    db[task_collection].find({"project_id": project_id}))
-                                task_list = [
-                                    {
-                                        'task_name': task.get('task_name'),
-                                        'task_assignee': task.get('task_assignee'),
-                                        'reporter': task.get('reporter'),
-                                        'task_status': task.get('task_status'),
-                                        'task_priority': task.get('task_priority'),
-                                        'task_createdOn': task.get('task_createdOn'),
-                                        'estimated_task_start_date': task.get('estimated_task_start_date'),
-                                        'estimated_task_end_date': task.get('estimated_task_end_date'),
-                                    }
-                                    for task in tasks
-                                ]
-                                context['tasks'] = task_list
-                            else:
-                                context = {"message": "project not found"}
-                        else:
-                            context = {"message": "project not found"}
-                    project_info = {k: v for k, v in find_project.items() if k not in [
-                        '_id', 'project_id', 'org_id']}
-                    project_info['assignees'] = [assignee['username'] for assignee in db[user_collection].find(
-                        {'data.projectData.project_id': project_id, "organization": org_id})]
-                    context = project_info
-                else:
-                    context = {
-                        "message": "You do not have access to get this project details."}
-            elif find_lead:
-                lead_id = find_lead.get("lead_id")
-                check_user_access = db[user_collection].find_one({"_id": ObjectId(
-                    user_id), "organization": org_id, "data.leadData.lead_id": lead_id})
-                if check_user_access:
-                    lead_info = {k: v for k, v in find_lead.items() if k not in [
-                        '_id', 'lead_id', 'org_id']}
-                    lead_info['assignees'] = [assignee['username'] for assignee in db[user_collection].find(
-                        {'data.leadData.lead_id': lead_id, "organization": org_id})]
-                    context = lead_info
-                else:
-                    context = {
-                        "message": "You do not have access to this lead."}
-            else:
-                context = {"message": "You do not have access to get details."}
-            conversation_history[user_id] = model_answer
-        # print(context)
-
-        if not context:  # If no specific conditions match, use the context from the last answer
-            previous_answer = conversation_history.get(user_id)
-            if previous_answer:
-                context = previous_answer
-            else:
-                context = {
-                    'message': "No specific project, lead, or task found. Here is the context from previous answer."}
-        conversation_history[user_id] = context
-
-        # Prepare the request to the Gemini API
-        # gemini_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent'
-        initializ_url = 'https://colonelz.prod.devai.initz.run/initializ/v1/ai/chat'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {TOKEN}'
-        }
-        data = {
-
-            "model": "meta-llama/Meta-Llama-3.1-8B-Instruct",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that provides accurate answers to questions based on the provided context. Never send the details directly in the response. Always summarize or provide relevant information as needed, without raw data."
-                },
-                {
-                    "role": "user",
-                    "content": f"Summarize the following details '{request.question}' and the info: {context}.",
-                }
-            ],
-            "max_tokens": 5000,
-            "temperature": 0.7,
-            # "stream": False,
-            "stream": True
-
-        }
-
-        # Call the Gemini API
-        response = requests.post(
-            initializ_url, headers=headers, json=data)
-        if response.status_code == 200:
-            print("Response Status: 200 OK")
-        else:
-            print(f"Error: {response.status_code}")
-            # Print the raw content of the error response
-            print("Error Response Content:")
-            print(response.text)
-
-        # Streaming response generator
-        async def event_generator(project_id, lead_id, task_id):
-            projectId = True
-            leadId = True
-            taskId = True
-            for chunk in response.iter_lines(decode_unicode=True):
-                if chunk:
-                    yield f"{chunk.strip()}\n\n"
-                    # await asyncio.sleep(1)
-                    if project_id and task_id:
-                        if taskId:
-                            yield f"data: task_id:{task_id}\n\n"
-                            taskId = False
-                        if projectId:
-                            yield f"data: project_id:{project_id}\n\n"
-                            projectId = False
-
-                    elif project_id:
-                        if projectId:
-                            yield f"data: project_id:{project_id}\n\n"
-                            projectId = False
-                    if lead_id:
-                        if leadId:
-                            yield f"data: lead_id:{lead_id}\n\n"
-                            leadId = False
-
-        return StreamingResponse(event_generator(project_id, lead_id, task_id), media_type="text/event-stream")
 
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    timings = metrics.begin_request()
+    status = 500
+    try:
+        if not request.questions or len(request.questions) > BATCH_MAX_QUESTIONS:
+            raise HTTPException(
+                status_code=422, detail=f"Send between 1 and {BATCH_MAX_QUESTIONS} questions")
+        org_id = request.org_id
+        user_id = request.user_id
+        with metrics.stage('intent'):
+            intents = [intent.parse(question) for question in request.questions]
+        with metrics.stage('identity'):
+            check_org, check_user, entities = await check_identity(org_id, user_id)
+        role = check_user.get('role')
+        # One plan for every question, so lookups they share run once
+        plan = query_planner.Plan()
+        stored = stored_reader(user_id)
+        with metrics.stage('context'):
+            contexts = await asyncio.gather(*(
+                build_context(parsed, role, org_id, user_id, check_org, entities, plan, stored)
+                for parsed in intents))
+            # Stored once, in question order: the last question's context is
+            # the one to follow up on, and later page positions win
+            pages = None
+            for *_, cursors in contexts:
+                if cursors is not None:
+                    pages = {**(pages or {}), **cursors}
+            await save_context(user_id, contexts[-1][0], pages)
+        streams = [
+            (qid, functools.partial(answer_events, question, role, org_id, *built[:4]))
+            for qid, (question, built) in enumerate(zip(request.questions, contexts))]
+        status = 200
+        return StreamingResponse(metrics.counting(multiplex(streams), '/query/batch', timings),
+                                 media_type="text/event-stream", headers=response_headers(plan, timings))
+
+    except HTTPException as e:
+        status = e.status_code
+        raise
     except Exception as e:
-        print(f"Error: {e}")
+        metrics.log('query_failed', 'error', endpoint='/query/batch', status=status, error=repr(e))
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        metrics.requests.inc('/query/batch', str(status))
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Counts are per worker process; Prometheus sums them across targets
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"responses": response_cache.stats(), "upstream": upstream_gateway.stats()}
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(request: CacheInvalidateRequest):
+    # Called by the CRM backend after it edits an organisation or a user
+    if request.user_id:
+        auth_cache.invalidate_user(request.user_id, request.org_id)
+    else:
+        auth_cache.invalidate_org(request.org_id)
+        entity_index.invalidate(request.org_id)
+    return {"status": "ok"}
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,42 @@
+import os
+import metrics
+from data_access import db, project_collection, lead_collection, user_collection, task_collection
+
+
+# Indexes the query handlers rely on. Set MONGO_CREATE_INDEXES=0 to only
+# report the missing ones (for example when the app user cannot create them).
+REQUIRED_INDEXES = [
+    (project_collection, [('project_name', 1), ('org_id', 1)]),
+    (project_collection, [('project_id', 1), ('org_id', 1)]),
+    (lead_collection, [('name', 1), ('org_id', 1)]),
+    (lead_collection, [('lead_id', 1), ('org_id', 1)]),
+    # "all projects" / "all leads" pages and the entity index build
+    (project_collection, [('org_id', 1), ('_id', -1)]),
+    (lead_collection, [('org_id', 1), ('_id', -1)]),
+    (task_collection, [('org_id', 1)]),
+    (user_collection, [('data.projectData.project_id', 1)]),
+    (user_collection, [('data.leadData.lead_id', 1)]),
+    (user_collection, [('username', 1), ('organization', 1)]),
+    (user_collection, [('organization', 1)]),
+]
+MONGO_CREATE_INDEXES = os.getenv('MONGO_CREATE_INDEXES', '1') == '1'
+
+
+def ensure_indexes():
+    missing = []
+    existing = {}
+    for collection, keys in REQUIRED_INDEXES:
+        if collection not in existing:
+            existing[collection] = [
+                [tuple(key) for key in info['key']]
+                for info in db[collection].index_information().values()
+            ]
+        if keys not in existing[collection]:
+            missing.append((collection, keys))
+
+    for collection, keys in missing:
+        metrics.log('index_missing', 'warning', collection=collection, keys=keys)
+        if MONGO_CREATE_INDEXES:
+            db[collection].create_index(keys)
+            metrics.log('index_created', collection=collection, keys=keys)
+    return missing
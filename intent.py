@@ -0,0 +1,84 @@
+import os
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+
+# Values sent in the project_id/lead_id/task_id metadata events when the
+# answer covers every project, lead or task. Clients match on them.
+ALL_PROJECTS_ID = '00000000000'
+ALL_LEADS_ID = '111111'
+ALL_TASKS_ID = '222222222'
+
+INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE', '4096'))
+
+
+class Intent(NamedTuple):
+    greeting: bool = False
+    all_projects: bool = False
+    all_leads: bool = False
+    all_tasks: bool = False
+    project_name: Optional[str] = None
+    lead_name: Optional[str] = None
+    task_name: Optional[str] = None
+    user_name: Optional[str] = None
+    # None, or the lists a "next page" question continues; empty means all
+    page_request: Optional[Tuple[str, ...]] = None
+
+
+# Every pattern in one alternation so a question is scanned once. Matches
+# may only start at a word boundary on one of the letters the patterns start
+# with, which lets the scan skip most positions cheaply. The name slots
+# capture inside a lookahead, which consumes only the "of project " prefix;
+# the scan then carries on inside the name, the same way the separate
+# searches used to look at the whole question.
+_PATTERN = re.compile(r'''\b(?=[aeghlmnostuw])(?:
+    (?P<greeting>(?:hello|hi|hey|greetings|good\ (?:morning|afternoon|evening|day))\b)
+  | (?P<all_projects>(?:entire|all|whole)\ projects?\b)
+  | (?P<all_leads>(?:entire|all|whole)\ leads?\b)
+  | (?P<all_tasks>(?:entire|all|whole)\ tasks?\b)
+  | (?P<page>(?:next\ page|next\ ones|(?:show\ )?more\ (?P<page_list>projects?|leads?|tasks?)|show\ more)\b)
+  | of\ project\ (?=(?P<project>[\w\s]+))
+  | of\ lead\ (?=(?P<lead>[\w\s]+))
+  | task\s+(?=(?P<task>[a-zA-Z\s]+?)(?=\s+of|\s*$))
+  | user\ (?=(?P<user>[\w\s]+))
+)''', re.IGNORECASE | re.VERBOSE)
+
+_FLAGS = ('greeting', 'all_projects', 'all_leads', 'all_tasks')
+_NAMES = {'project': 'project_name', 'lead': 'lead_name', 'task': 'task_name', 'user': 'user_name'}
+_spaces = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=INTENT_CACHE_SIZE)
+def parse(question):
+    """Parse a question into an Intent; repeated questions come from a memo."""
+    question = _spaces.sub(' ', question.strip())
+    found = {}
+    for match in _PATTERN.finditer(question):
+        slot = match.lastgroup
+        if slot in _FLAGS:
+            found[slot] = True
+        elif slot == 'page':
+            if 'page_request' not in found:
+                page_list = match.group('page_list')
+                if page_list:
+                    page_list = page_list.lower()
+                    found['page_request'] = (page_list if page_list.endswith('s') else page_list + 's',)
+                else:
+                    found['page_request'] = ()
+        elif _NAMES[slot] not in found:
+            # The first mention of each kind wins, as with re.search
+            value = match.group(slot)
+            found[_NAMES[slot]] = value.strip() if slot == 'task' else value
+    # A request for every project/lead/task ignores the single name
+    if found.get('all_projects'):
+        found.pop('project_name', None)
+    if found.get('all_leads'):
+        found.pop('lead_name', None)
+    if found.get('all_tasks'):
+        found.pop('task_name', None)
+    # "show more details of lead X" names what it wants; only a question
+    # that names nothing and asks for no list continues the previous pages
+    if any(key != 'greeting' and key != 'page_request' for key in found):
+        found.pop('page_request', None)
+    return Intent(**found)
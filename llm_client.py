@@ -0,0 +1,62 @@
+import os
+import httpx
+
+
+INITIALIZ_URL = os.getenv(
+    'INITIALIZ_URL', 'https://colonelz.prod.devai.initz.run/initializ/v1/ai/chat')
+TOKEN = os.getenv('TOKEN')
+
+# Pool and timeout settings for the shared upstream client
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '20'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '30'))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '60'))
+LLM_POOL_TIMEOUT = float(os.getenv('LLM_POOL_TIMEOUT', '10'))
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=LLM_CONNECT_TIMEOUT,
+                read=LLM_READ_TIMEOUT,
+                write=LLM_CONNECT_TIMEOUT,
+                pool=LLM_POOL_TIMEOUT,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def build_headers():
+    return {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {TOKEN}'
+    }
+
+
+async def open_stream(data):
+    """Send the chat request and return the response with the body unread.
+
+    The caller owns the response and must close it (``await response.aclose()``)
+    once it has consumed the body.
+    """
+    client = get_client()
+    request = client.build_request(
+        'POST', INITIALIZ_URL, headers=build_headers(), json=data)
+    return await client.send(request, stream=True)
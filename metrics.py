@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Seconds; from a cached lookup to a slow LLM answer
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# Bytes or characters
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+_logger = logging.getLogger('chatbot')
+if not _logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(_handler)
+    _logger.setLevel(LOG_LEVEL)
+    _logger.propagate = False
+
+
+_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO,
+           'warning': logging.WARNING, 'error': logging.ERROR}
+
+
+def log(event, level='info', **fields):
+    """Write one JSON log line: ``{"ts", "level", "event", **fields}``."""
+    if _logger.isEnabledFor(_LEVELS[level]):
+        _logger.log(_LEVELS[level], json.dumps(
+            {'ts': round(time.time(), 3), 'level': level, 'event': event, **fields}, default=str))
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self._values.items():
+            yield f'{self.name}{_label_text(self.labels, labels)} {value}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format.
+
+    Observations are only made from the event loop thread, so plain dicts
+    and lists are enough.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in self._series.items():
+            running = 0
+            for bound, n in zip(self.buckets, counts):
+                running += n
+                le = _label_text(self.labels + ('le',), labels + (bound,))
+                yield f'{self.name}_bucket{le} {running}'
+            le = _label_text(self.labels + ('le',), labels + ('+Inf',))
+            yield f'{self.name}_bucket{le} {count}'
+            yield f'{self.name}_sum{_label_text(self.labels, labels)} {total}'
+            yield f'{self.name}_count{_label_text(self.labels, labels)} {count}'
+
+
+class Gauge:
+    """A value read when /metrics is scraped; ``kind='counter'`` for totals
+    kept elsewhere."""
+
+    def __init__(self, name, help, read, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield f'{self.name} {self.read()}'
+
+
+_registry = []
+
+requests = Counter('chatbot_requests_total', 'Requests by endpoint and status', ('endpoint', 'status'))
+stage_seconds = Histogram('chatbot_stage_seconds', 'Time spent per request stage', ('stage',))
+mongo_seconds = Histogram('chatbot_mongo_seconds', 'Mongo query time', ('op', 'collection'))
+context_chars = Histogram('chatbot_context_chars', 'Characters of context put in the prompt',
+                          buckets=SIZE_BUCKETS)
+upstream_seconds = Histogram(
+    'chatbot_upstream_seconds',
+    'LLM call phases: queue wait, then connect, first token and whole stream since sending',
+    ('phase',))
+upstream_errors = Counter('chatbot_upstream_errors_total', 'Failed LLM calls by reason', ('reason',))
+streamed_bytes = Histogram('chatbot_streamed_bytes', 'Bytes streamed per answer', buckets=SIZE_BUCKETS)
+
+# Stage durations of the request being served, for its Server-Timing header
+_timings = ContextVar('timings', default=None)
+
+
+def begin_request():
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def add_timing(stage, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, name)
+        add_timing(name, elapsed)
+
+
+async def timed_query(op, collection, call):
+    """Await ``call()`` as one Mongo query, counted as ``db`` in Server-Timing."""
+    started = time.perf_counter()
+    try:
+        return await call()
+    finally:
+        elapsed = time.perf_counter() - started
+        mongo_seconds.observe(elapsed, op, collection)
+        add_timing('db', elapsed)
+
+
+def server_timing(timings):
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
+
+
+async def counting(events, endpoint, timings):
+    """Pass ``events`` through, then record and log what was streamed."""
+    started = time.perf_counter()
+    size = 0
+    status = 'ok'
+    try:
+        async for event in events:
+            size += len(event)
+            yield event
+    except BaseException:
+        status = 'aborted'
+        raise
+    finally:
+        streamed_bytes.observe(size)
+        log('answer', endpoint=endpoint, status=status, bytes=size,
+            stream_ms=round((time.perf_counter() - started) * 1000, 1),
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in timings.items()})
+
+
+def render():
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
@@ -0,0 +1,77 @@
+from datetime import date, datetime
+from bson import ObjectId
+
+
+# Rough size of a Llama token in characters, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == [] or value == {}
+
+
+def format_value(value):
+    """Render a scalar or nested value compactly and deterministically."""
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.date().isoformat()
+        return value.replace(microsecond=0).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        # Ids mean nothing to the model; the last 6 hex digits still tell
+        # two records apart.
+        return str(value)[-6:]
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{k}: {format_value(v)}' for k, v in value.items()
+                               if not _is_empty(v) and not isinstance(v, ObjectId)) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(format_value(v) for v in value if not _is_empty(v)) + ']'
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    return str(value).replace('\n', ' ').replace('|', '/')
+
+
+def format_table(name, records):
+    """Column-oriented table: a header line with the columns, then one row per record.
+
+    Columns keep first-seen order and columns that are empty in every record
+    are dropped.
+    """
+    columns = []
+    for record in records:
+        for key, value in record.items():
+            if key not in columns and not _is_empty(value) and not isinstance(value, ObjectId):
+                columns.append(key)
+    lines = [f"{name} ({len(records)}): " + ' | '.join(columns)]
+    for record in records:
+        lines.append(' | '.join(
+            '' if _is_empty(record.get(c)) else format_value(record.get(c)) for c in columns))
+    return '\n'.join(lines)
+
+
+def _is_table(value):
+    return isinstance(value, list) and value and all(isinstance(v, dict) for v in value)
+
+
+def serialize_context(context):
+    """Turn a context dict into the compact text put in the prompt.
+
+    Scalars become ``key: value`` lines, lists of records become tables.
+    ObjectIds are dropped and empty fields omitted, so the same data always
+    gives the same text.
+    """
+    lines = []
+    tables = []
+    for key, value in context.items():
+        if _is_empty(value) or isinstance(value, ObjectId) or key == '_id':
+            continue
+        if _is_table(value):
+            tables.append(format_table(key, value))
+        else:
+            lines.append(f'{key}: {format_value(value)}')
+    return '\n'.join(lines + tables)
@@ -0,0 +1,242 @@
+import os
+import time
+import asyncio
+from typing import NamedTuple, FrozenSet, Optional
+from fastapi import HTTPException
+import data_access
+import entity_index
+import intent
+import context_assembler
+from data_access import project_collection, lead_collection, user_collection, task_collection
+from field_specs import USER_PROFILE
+
+
+# Print the executed plan and send it in an X-Query-Plan header
+QUERY_PLAN_DEBUG = os.getenv('QUERY_PLAN_DEBUG', '0') == '1'
+
+
+class AccessRules(NamedTuple):
+    # "all ..." lists the role may read
+    lists: FrozenSet[str]
+    task_detail: bool
+    user_detail: bool
+    # Only projects and leads the user is assigned to
+    assigned_only: bool
+
+
+FULL_ACCESS = AccessRules(frozenset({'projects', 'leads', 'tasks'}), True, True, False)
+ROLE_RULES = {
+    'ADMIN': FULL_ACCESS,
+    'SUPERADMIN': FULL_ACCESS,
+    'Senior Architect': AccessRules(frozenset({'projects', 'leads', 'tasks'}), False, False, False),
+}
+DEFAULT_RULES = AccessRules(frozenset({'tasks'}), False, False, True)
+
+PROJECT_HIDDEN = ['_id', 'project_id', 'org_id', 'fileId', 'assignees']
+LEAD_HIDDEN = ['_id', 'lead_id', 'org_id', 'assignees']
+
+
+class Step:
+    __slots__ = ('key', 'fn', 'task', 'started', 'finished')
+
+    def __init__(self, key, fn):
+        self.key = key
+        self.fn = fn
+        self.task = None
+        self.started = None
+        self.finished = None
+
+
+class Plan:
+    """Independent fetch steps keyed by what they read.
+
+    Adding a step whose key is already planned reuses it, so one plan can
+    serve several questions. A step starts the first time its result is
+    awaited and may await other steps it depends on.
+    """
+
+    def __init__(self):
+        self.steps = {}
+        self.created = time.perf_counter()
+
+    def add(self, key, fn):
+        if key not in self.steps:
+            self.steps[key] = Step(key, fn)
+        return key
+
+    def result(self, key):
+        step = self.steps[key]
+        if step.task is None:
+            step.task = asyncio.ensure_future(self._run(step))
+        return step.task
+
+    async def _run(self, step):
+        step.started = time.perf_counter()
+        try:
+            return await step.fn()
+        finally:
+            step.finished = time.perf_counter()
+
+    def timings(self):
+        return [
+            {'step': step.key,
+             'start_ms': round((step.started - self.created) * 1000, 1),
+             'ms': round((step.finished - step.started) * 1000, 1)}
+            for step in self.steps.values() if step.finished is not None
+        ]
+
+
+class PlanResult(NamedTuple):
+    context: dict
+    project_id: Optional[str]
+    lead_id: Optional[str]
+    task_id: Optional[str]
+    # Cursors of the paged lists, or None when no list was planned
+    cursors: Optional[dict]
+
+
+def _entity_step(plan, collection, filter, id_field, assignee_field, org_id):
+    return plan.add(
+        f"{collection}:{filter}",
+        lambda: data_access.find_one_with_assignees(collection, filter, id_field, assignee_field, org_id))
+
+
+def _page_step(plan, list_key, filter_fn, share, depends_on=None):
+    async def fetch():
+        if depends_on is not None:
+            filter = filter_fn(await plan.result(depends_on))
+            if filter is None:
+                return None
+        else:
+            filter = filter_fn(None)
+        records, next_offset = await context_assembler.fetch_page(list_key, filter, 0, share)
+        return records, {'filter': filter, 'start': 0, 'offset': next_offset}
+    return plan.add(f"page:{list_key}:{depends_on or ''}:{share}", fetch)
+
+
+async def execute(parsed, role, org_id, user_id, org, entities, plan=None):
+    """Fetch the context ``parsed`` asks for, as far as ``role`` may see it."""
+    rules = ROLE_RULES.get(role, DEFAULT_RULES)
+    plan = plan or Plan()
+    mentions = entities.find(' '.join(filter(None, (
+        parsed.project_name, parsed.lead_name, parsed.task_name, parsed.user_name))))
+    messages = []
+
+    # Names the entity index knows are looked up by id
+    project_step = lead_step = user_step = task_step = None
+    known_project = entity_index.pick(mentions, 'project', parsed.project_name)
+    if parsed.project_name:
+        project_filter = {"project_name": parsed.project_name, "org_id": org_id}
+        if known_project:
+            project_filter = {"project_id": known_project[1][0], "org_id": org_id}
+        project_step = _entity_step(plan, project_collection, project_filter,
+                                    'project_id', 'data.projectData.project_id', org_id)
+    if parsed.lead_name and not parsed.all_leads:
+        lead_filter = {"name": parsed.lead_name, "org_id": org_id}
+        known_lead = entity_index.pick(mentions, 'lead', parsed.lead_name)
+        if known_lead:
+            lead_filter = {"lead_id": known_lead[1][0], "org_id": org_id}
+        lead_step = _entity_step(plan, lead_collection, lead_filter,
+                                 'lead_id', 'data.leadData.lead_id', org_id)
+    if parsed.user_name and rules.user_detail:
+        known_user = entity_index.pick(mentions, 'user', parsed.user_name)
+        user_filter = {"username": known_user[0] if known_user else parsed.user_name,
+                       "organization": org_id}
+        user_step = plan.add(
+            f"{user_collection}:{user_filter}",
+            lambda: data_access.find_one(user_collection, user_filter, USER_PROFILE.projection))
+    if parsed.task_name and not parsed.all_tasks and project_step and rules.task_detail:
+        known_task = entity_index.pick(
+            mentions, 'task', parsed.task_name, known_project[1][0] if known_project else None)
+
+        async def find_task():
+            project = await plan.result(project_step)
+            if not project:
+                return None
+            task_filter = {"project_id": project.get("project_id"), "task_name": parsed.task_name}
+            if known_task:
+                task_filter = {"project_id": project.get("project_id"), "task_id": known_task[1][1]}
+            return await data_access.find_one(task_collection, task_filter)
+        task_step = plan.add(f"{task_collection}:{project_step}:{parsed.task_name}", find_task)
+
+    # "all ..." lists share the prompt budget
+    wanted = [key for key, asked in (('projects', parsed.all_projects), ('leads', parsed.all_leads),
+                                     ('tasks', parsed.all_tasks and project_step is not None))
+              if asked]
+    allowed = [key for key in wanted if key in rules.lists]
+    if len(allowed) < len(wanted) or (parsed.user_name and not rules.user_detail):
+        messages.append("You do not have access to get details.")
+    share = context_assembler.PROMPT_TOKEN_BUDGET // max(len(allowed), 1)
+    page_steps = {}
+    for key in allowed:
+        if key == 'tasks':
+            page_steps[key] = _page_step(
+                plan, key, lambda project: {"project_id": project["project_id"]} if project else None,
+                share, project_step)
+        else:
+            page_steps[key] = _page_step(plan, key, lambda _: {"org_id": org_id}, share)
+
+    planned = [step for step in (project_step, lead_step, user_step, task_step) if step]
+    planned += page_steps.values()
+    results = dict(zip(planned, await asyncio.gather(*(plan.result(step) for step in planned))))
+
+    context = {}
+    project_id = intent.ALL_PROJECTS_ID if parsed.all_projects else None
+    lead_id = intent.ALL_LEADS_ID if parsed.all_leads else None
+    task_id = intent.ALL_TASKS_ID if parsed.all_tasks else None
+    cursors = {} if page_steps else None
+
+    for key, step in page_steps.items():
+        page = results[step]
+        if page is None:
+            continue
+        context[key], cursors[key] = page
+
+    project = results.get(project_step)
+    # "all tasks" needs the project they belong to
+    if (project_step and not project) or (parsed.all_tasks and not project_step):
+        messages.append("project not found")
+    elif project:
+        has_access = not rules.assigned_only or any(
+            str(assignee['_id']) == user_id for assignee in project['assignees'])
+        if not has_access:
+            # The task page was read alongside the access check; drop it
+            context.pop('tasks', None)
+            if cursors:
+                cursors.pop('tasks', None)
+            messages.append("You do not have access to get this project details.")
+        else:
+            project_id = project.get("project_id")
+            if task_step:
+                task = results[task_step]
+                if task:
+                    task_id = task.get("task_id")
+                    context.update(task)
+                else:
+                    messages.append("task not found")
+            elif 'tasks' not in context:
+                context.update({k: v for k, v in project.items() if k not in PROJECT_HIDDEN})
+                context['assignees'] = [assignee['username'] for assignee in project['assignees']]
+
+    lead = results.get(lead_step)
+    if lead_step and not lead:
+        messages.append("lead not found.")
+    elif lead:
+        if rules.assigned_only and not any(
+                str(assignee['_id']) == user_id for assignee in lead['assignees']):
+            messages.append("You do not have access to this lead.")
+        else:
+            lead_id = lead.get("lead_id")
+            context.update({k: v for k, v in lead.items() if k not in LEAD_HIDDEN})
+            context['assignees'] = [assignee['username'] for assignee in lead['assignees']]
+
+    if user_step:
+        user = results[user_step]
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
+        context.update(USER_PROFILE.shape(user))
+        context['organisation_name'] = org.get('organization')
+
+    if messages:
+        context['message'] = ' '.join(messages)
+    return PlanResult(context, project_id, lead_id, task_id, cursors)
@@ -0,0 +1,61 @@
+import os
+import re
+import hashlib
+from ttl_cache import TTLCache
+
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '300'))
+# Longer answers are streamed but not kept
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRY_BYTES', str(64 * 1024)))
+
+_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+_spaces = re.compile(r'\s+')
+_trailing = re.compile(r'[\s?.!]+$')
+
+
+def normalize_question(question):
+    return _trailing.sub('', _spaces.sub(' ', question.strip().lower()))
+
+
+def make_key(question, role, prompt_context, ids):
+    """Key on what decides the answer: the question, the role and the context.
+
+    ``ids`` are the project/lead/task ids sent as metadata events, which are
+    part of the replayed stream.
+    """
+    digest = hashlib.sha256()
+    for part in (normalize_question(question), str(role), prompt_context, repr(ids)):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get(key):
+    return _cache.get(key)
+
+
+async def replay(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def recording(key, events):
+    """Pass ``events`` through and cache them once the stream completes."""
+    chunks = []
+    size = 0
+    async for chunk in events:
+        if size <= RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            chunks.append(chunk)
+            size += len(chunk)
+        yield chunk
+    if size <= RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        _cache.set(key, tuple(chunks))
+
+
+def stats():
+    return {'hits': _cache.hits, 'misses': _cache.misses, 'entries': len(_cache)}
+
+
+def clear():
+    _cache.clear()
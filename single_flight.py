@@ -0,0 +1,101 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    Every caller gets the same result object, so callers must treat it as
+    read-only.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A caller that goes away must not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class _StreamFlight:
+    def __init__(self, source, on_done):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._on_done(self)
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self):
+        # Each subscriber keeps its own position in the shared chunk list, so
+        # the pump never waits for anyone and a slow client only delays itself.
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                changed = self._changed
+                if position < len(self.chunks):
+                    chunk = self.chunks[position]
+                    position += 1
+                    yield chunk
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                # Nobody is listening any more; stop paying for the upstream
+                self._on_done(self)
+                self._task.cancel()
+
+
+class StreamGroup:
+    """Share one upstream stream between concurrent requests with the same key.
+
+    The first request for a key starts ``factory()``; requests arriving while
+    it runs attach to it and receive every chunk from the beginning.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def subscribe(self, key, factory):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _StreamFlight(factory(), lambda done: self._release(key, done))
+            self._flights[key] = flight
+        return flight.follow()
+
+    def _release(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def __len__(self):
+        return len(self._flights)
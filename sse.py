@@ -0,0 +1,195 @@
+import re
+import json
+import codecs
+from json.decoder import scanstring
+
+
+# Longest "<..." kept back waiting for its ">". Longer runs are sent as
+# text so a stray "<" cannot hold up the rest of the line.
+MAX_TAG = 256
+
+
+def clean_response_text(text):
+    clean_text = re.sub(r'\*+', '', text)
+    clean_text = re.sub(r'\<.*?\>', '', clean_text)
+    clean_text = clean_text.replace('\n', ' ')
+    clean_text = clean_text.strip()
+    return clean_text
+
+
+class TextCleaner:
+    """``clean_response_text`` applied to a text that arrives in pieces.
+
+    Each piece is scanned once. Only an unfinished ``<...`` tag and trailing
+    whitespace are held back until the next piece shows what they are.
+    """
+
+    def __init__(self):
+        self._tag = None
+        self._space = ''
+        self._started = False
+
+    def feed(self, text):
+        text = text.replace('*', '')
+        out = []
+        while text:
+            if self._tag is None:
+                start = text.find('<')
+                if start == -1:
+                    out.append(text)
+                    break
+                out.append(text[:start])
+                self._tag = '<'
+                text = text[start + 1:]
+                continue
+            end = text.find('>')
+            newline = text.find('\n')
+            if end != -1 and (newline == -1 or end < newline):
+                # A whole tag: drop it
+                self._tag = None
+                text = text[end + 1:]
+            elif newline != -1 or len(self._tag) + len(text) > MAX_TAG:
+                # Tags never span lines; what was held is plain text
+                cut = newline if newline != -1 else len(text)
+                out.append(self._tag + text[:cut])
+                self._tag = None
+                text = text[cut:]
+            else:
+                self._tag += text
+                text = ''
+        return self._trim(''.join(out))
+
+    def _trim(self, text):
+        text = text.replace('\n', ' ')
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self._started = True
+        body = text.rstrip()
+        if not body:
+            self._space += text
+            return ''
+        text, self._space = self._space + body, text[len(body):]
+        return text
+
+    def finish(self):
+        """The rest of the text once the stream has ended."""
+        tag, self._tag = self._tag, None
+        return self._trim(tag) if tag else ''
+
+
+class FrameParser:
+    """Split an SSE byte stream into the payloads of its ``data:`` fields.
+
+    Chunks may end anywhere, in the middle of a frame or of a UTF-8
+    character; the incomplete part waits for the next chunk.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._buffer = ''
+        self._data = []
+
+    def feed(self, chunk):
+        # Only the unfinished last line is kept from the previous chunk
+        *lines, self._buffer = (self._buffer + self._decoder.decode(chunk)).split('\n')
+        payloads = []
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line:
+                # A blank line ends the frame
+                if self._data:
+                    payloads.append('\n'.join(self._data))
+                    self._data = []
+            elif line.startswith('data:'):
+                value = line[5:]
+                self._data.append(value[1:] if value.startswith(' ') else value)
+        return payloads
+
+    def finish(self):
+        if self._buffer.startswith('data:'):
+            value = self._buffer[5:]
+            self._data.append(value[1:] if value.startswith(' ') else value)
+        self._buffer = ''
+        payloads = ['\n'.join(self._data)] if self._data else []
+        self._data = []
+        return payloads
+
+
+def content_of(payload):
+    """The text of an OpenAI-style chunk, None if it carries none."""
+    # Chunks carry one "content" string; decoding just that literal is a
+    # few times cheaper than parsing the whole payload
+    start = payload.find('"content":')
+    if start != -1:
+        start += 10
+        while payload[start:start + 1] == ' ':
+            start += 1
+        if payload[start:start + 1] == '"':
+            try:
+                return scanstring(payload, start + 1)[0]
+            except ValueError:
+                pass
+    try:
+        choice = json.loads(payload)['choices'][0]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    delta = choice.get('delta') or choice.get('message') or {}
+    return delta.get('content')
+
+
+def token_event(text):
+    return 'data: ' + json.dumps({"choices": [{"delta": {"content": text}}]}) + '\n\n'
+
+
+def metadata_events(project_id, lead_id, task_id):
+    events = []
+    if project_id and task_id:
+        events.append(f"data: task_id:{task_id}\n\n")
+    if project_id:
+        events.append(f"data: project_id:{project_id}\n\n")
+    if lead_id:
+        events.append(f"data: lead_id:{lead_id}\n\n")
+    return ''.join(events)
+
+
+async def reframe(chunks, metadata=''):
+    """Re-frame an upstream chat stream for the client.
+
+    Each upstream read becomes at most one write: the cleaned text of every
+    complete frame in it, as one token event. ``metadata`` is held until the
+    first read and goes out in front of its text, so nothing is sent before
+    the upstream has answered. The stream always ends with ``data: [DONE]``.
+    """
+    parser = FrameParser()
+    cleaner = TextCleaner()
+
+    def events(payloads):
+        text = []
+        done = False
+        for payload in payloads:
+            if payload == '[DONE]':
+                done = True
+                continue
+            content = content_of(payload)
+            if content:
+                text.append(content)
+        return cleaner.feed(''.join(text)), done
+
+    done = False
+    async for chunk in chunks:
+        if done:
+            # Nothing follows [DONE]; read on so the upstream ends cleanly
+            continue
+        text, done = events(parser.feed(chunk))
+        out = metadata + token_event(text) if text else metadata
+        metadata = ''
+        if out:
+            yield out
+    if not done:
+        text, _ = events(parser.finish())
+        if text:
+            metadata += token_event(text)
+    tail = cleaner.finish()
+    yield metadata + (token_event(tail) if tail else '') + 'data: [DONE]\n\n'
@@ -0,0 +1,4 @@
+import os
+
+# data_access opens its database at import time
+os.environ.setdefault('DATABASE_NAME', 'chatbot_test')
@@ -0,0 +1,69 @@
+"""The assignee lookup, in both of its forms.
+
+The MONGO_LOOKUP_PIPELINE form needs a real MongoDB 5.0+; set
+MONGODB_TEST_URI to run it. The fallback form also runs on mongomock.
+"""
+import os
+import uuid
+import asyncio
+import pytest
+import data_access
+
+MONGODB_TEST_URI = os.getenv('MONGODB_TEST_URI')
+
+USERS = [
+    {'username': 'alice', 'organization': 'org1', 'password': 'x', 'refreshToken': 'y',
+     'data': [{'projectData': [{'project_id': 'P1'}], 'leadData': [{'lead_id': 'L1'}]}]},
+    # Assignments spread over several data entries
+    {'username': 'bob', 'organization': 'org1',
+     'data': [{'projectData': [{'project_id': 'P2'}]}, {'projectData': [{'project_id': 'P1'}]}]},
+    # Assigned, but in another org
+    {'username': 'carol', 'organization': 'org2', 'data': [{'projectData': [{'project_id': 'P1'}]}]},
+    # Not assigned, or with data in unexpected shapes
+    {'username': 'dave', 'organization': 'org1'},
+    {'username': 'erin', 'organization': 'org1', 'data': 'none'},
+    {'username': 'frank', 'organization': 'org1', 'data': [{'projectData': None}]},
+]
+
+
+def lookup(db, monkeypatch, pipeline, collection, filter, id_field, assignee_field):
+    monkeypatch.setattr(data_access, 'db', db)
+    monkeypatch.setattr(data_access, 'MONGO_LOOKUP_PIPELINE', pipeline)
+    return asyncio.run(data_access.find_one_with_assignees(
+        collection, filter, id_field, assignee_field, 'org1'))
+
+
+def check(db, monkeypatch, pipeline):
+    db.users.insert_many([dict(user) for user in USERS])
+    db.project.insert_one({'project_id': 'P1', 'org_id': 'org1', 'project_name': 'Alpha'})
+    db.Lead.insert_one({'lead_id': 'L1', 'org_id': 'org1', 'name': 'Dave'})
+
+    project = lookup(db, monkeypatch, pipeline, 'project', {'project_id': 'P1'}, 'project_id',
+                     'data.projectData.project_id')
+    assert project['project_name'] == 'Alpha'
+    assert sorted(user['username'] for user in project['assignees']) == ['alice', 'bob']
+    assert all(set(user) == {'_id', 'username'} for user in project['assignees'])
+
+    found = lookup(db, monkeypatch, pipeline, 'Lead', {'lead_id': 'L1'}, 'lead_id', 'data.leadData.lead_id')
+    assert [user['username'] for user in found['assignees']] == ['alice']
+
+    assert lookup(db, monkeypatch, pipeline, 'project', {'project_id': 'P9'}, 'project_id',
+                  'data.projectData.project_id') is None
+
+
+def test_fallback_lookup_on_mongomock(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    check(mongomock.MongoClient().db, monkeypatch, pipeline=False)
+
+
+@pytest.mark.skipif(not MONGODB_TEST_URI, reason='set MONGODB_TEST_URI to a MongoDB 5.0+ server')
+@pytest.mark.parametrize('pipeline', [True, False])
+def test_lookup_on_mongodb(monkeypatch, pipeline):
+    from pymongo import MongoClient
+    client = MongoClient(MONGODB_TEST_URI)
+    name = f'chatbot_test_{uuid.uuid4().hex[:8]}'
+    try:
+        check(client[name], monkeypatch, pipeline)
+    finally:
+        client.drop_database(name)
+        client.close()
@@ -0,0 +1,121 @@
+"""Name matching in the entity index."""
+import asyncio
+import pytest
+import data_access
+import entity_index
+from entity_index import Automaton, OrgIndex, pick
+
+
+def matcher(*terms):
+    automaton = Automaton()
+    for term in terms:
+        automaton.add(term, term)
+    return automaton.compile()
+
+
+def test_matcher_finds_whole_words_only():
+    found = list(matcher('alpha', 'pha', 'al').search('alpha and al, alphabet'))
+    assert found == [(0, 5, 'alpha'), (10, 12, 'al')]
+
+
+def test_matcher_finds_overlapping_terms():
+    found = sorted(matcher('alpha tower', 'tower', 'alpha').search('alpha tower b'))
+    assert found == [(0, 5, 'alpha'), (0, 11, 'alpha tower'), (6, 11, 'tower')]
+
+
+def test_compiled_matcher_does_not_see_later_changes():
+    automaton = Automaton()
+    automaton.add('alpha', 'alpha')
+    before = automaton.compile()
+    automaton.add('beta', 'beta')
+    assert automaton.remove('alpha', 'alpha')
+    assert not automaton.remove('alpha', 'alpha') and not automaton.remove('gamma', 'gamma')
+    assert [m[2] for m in before.search('alpha beta')] == ['alpha']
+    assert [m[2] for m in automaton.compile().search('alpha beta')] == ['beta']
+
+
+def org_index(*docs):
+    index = OrgIndex()
+    for kind, doc in docs:
+        index.upsert(kind, doc)
+    index.refresh()
+    return index
+
+
+ALPHA = ('project', {'_id': 1, 'project_name': 'Alpha', 'project_id': 'P1'})
+ALPHA_TOWER = ('project', {'_id': 2, 'project_name': 'Alpha  Tower', 'project_id': 'P2'})
+BOB = ('user', {'_id': 'u1', 'username': 'Bob'})
+
+
+def test_find_keeps_the_longest_match():
+    index = org_index(ALPHA, ALPHA_TOWER, BOB)
+    assert index.find('status of alpha tower') == {'project': [('Alpha  Tower', ('P2',))]}
+    assert index.find('ALPHA for user bob') == {
+        'project': [('Alpha', ('P1',))], 'user': [('Bob', ('u1',))]}
+
+
+def test_find_keeps_every_entry_with_the_same_span():
+    index = org_index(ALPHA, ('lead', {'_id': 3, 'name': 'alpha', 'lead_id': 'L1'}))
+    assert index.find('alpha') == {'project': [('Alpha', ('P1',))], 'lead': [('alpha', ('L1',))]}
+
+
+def test_find_sees_changes_after_refresh():
+    index = org_index(ALPHA)
+    assert index.upsert('project', {'_id': 1, 'project_name': 'Gamma', 'project_id': 'P1'})
+    assert not index.upsert('project', {'_id': 1, 'project_name': 'Gamma', 'project_id': 'P1'})
+    assert not index.upsert('project', {'_id': 4, 'project_name': ' '})
+    # Searches use the last compiled matcher until refresh
+    assert index.find('alpha gamma') == {'project': [('Alpha', ('P1',))]}
+    index.refresh()
+    assert index.find('alpha gamma') == {'project': [('Gamma', ('P1',))]}
+    assert index.delete(1) and not index.delete(1)
+    index.refresh()
+    assert index.find('alpha gamma') == {}
+
+
+def test_pick_resolves_names_inside_the_captured_slot():
+    index = org_index(ALPHA, ALPHA_TOWER, BOB)
+    # "status of project Alpha for user Bob": the planner searches the
+    # project slot and the user slot together
+    mentions = index.find('Alpha for user Bob Bob')
+    assert pick(mentions, 'project', 'Alpha for user Bob') == ('Alpha', ('P1',))
+    assert pick(mentions, 'user', 'Bob') == ('Bob', ('u1',))
+    assert pick(mentions, 'lead', 'Alpha') is None
+    assert pick(mentions, 'project', None) is None
+    # Whole words of the slot only
+    assert pick(index.find('Alphabet'), 'project', 'Alphabet') is None
+
+
+def test_pick_limits_tasks_to_the_project():
+    index = org_index(('task', {'_id': 5, 'task_name': 'paint', 'project_id': 'P1', 'task_id': 'T1'}),
+                      ('task', {'_id': 6, 'task_name': 'paint', 'project_id': 'P2', 'task_id': 'T2'}))
+    mentions = index.find('paint')
+    assert pick(mentions, 'task', 'paint', 'P2') == ('paint', ('P2', 'T2'))
+    assert pick(mentions, 'task', 'paint', 'P3') is None
+
+
+def test_expired_index_is_served_while_one_rebuild_runs(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(data_access, 'db', db)
+    monkeypatch.setattr(entity_index, '_indexes', entity_index.TTLCache(10, 0.05))
+    db.project.insert_one({'project_id': 'P1', 'project_name': 'Alpha', 'org_id': 'org1'})
+    builds = []
+    build = entity_index._build
+
+    async def counted(org_id):
+        builds.append(org_id)
+        return await build(org_id)
+    monkeypatch.setattr(entity_index, '_build', counted)
+
+    async def scenario():
+        first = await entity_index.get('org1')
+        await asyncio.sleep(0.1)
+        db.project.insert_one({'project_id': 'P2', 'project_name': 'Beta', 'org_id': 'org1'})
+        served = await asyncio.gather(*(entity_index.get('org1') for _ in range(5)))
+        await asyncio.gather(*entity_index._rebuilds.values())
+        return first, served, await entity_index.get('org1')
+    first, served, rebuilt = asyncio.run(scenario())
+    assert all(index is first for index in served)
+    assert builds == ['org1', 'org1']
+    assert rebuilt.find('beta') == {'project': [('Beta', ('P2',))]}
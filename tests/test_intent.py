@@ -0,0 +1,80 @@
+"""intent.parse against the inline parsing it replaced, and where they differ on purpose."""
+import pytest
+import intent
+from bench.intent import QUESTIONS, legacy_parse
+
+# None of these contain a greeting inside a longer word, where the two differ
+PARITY = QUESTIONS + [
+    '',
+    'good morning',
+    'Hey there, what about project Sunrise Villa',
+    'show all projects and all leads',
+    'entire tasks',
+    'all project',
+    'whole leads of lead Ravi',
+    'what is the status of project Alpha for user Bob',
+    'Task paint walls of project Alpha',
+    'task paint walls',
+    'tasks of project Alpha',
+    'details of lead Ravi Sharma and project Alpha',
+    'user',
+    'USER Bob',
+    'status of project Alpha_2 and of project Beta',
+]
+
+
+def as_legacy(parsed):
+    return (parsed.greeting,
+            intent.ALL_PROJECTS_ID if parsed.all_projects else None,
+            intent.ALL_LEADS_ID if parsed.all_leads else None,
+            intent.ALL_TASKS_ID if parsed.all_tasks else None,
+            parsed.project_name, parsed.lead_name, parsed.task_name, parsed.user_name)
+
+
+@pytest.mark.parametrize('question', PARITY)
+def test_parse_matches_legacy(question):
+    assert as_legacy(intent.parse(question)) == legacy_parse(question)
+
+
+def test_whitespace_is_normalized():
+    # The old patterns wanted single literal spaces
+    assert legacy_parse('user\tbob')[-1] is None
+    assert intent.parse('user\tbob').user_name == 'bob'
+    assert legacy_parse('task  paint   walls of project Alpha')[6] == 'paint   walls'
+    assert intent.parse('task  paint   walls of project Alpha').task_name == 'paint walls'
+
+
+def test_project_slot_can_start_the_question():
+    # The old pattern wanted a space before "of project"
+    assert legacy_parse('of project Alpha')[4] is None
+    assert intent.parse('of project Alpha').project_name == 'Alpha'
+
+
+@pytest.mark.parametrize('question', ['this project', 'which leads', 'shipping status', 'they'])
+def test_greetings_are_whole_words(question):
+    assert legacy_parse(question)[0]
+    assert not intent.parse(question).greeting
+
+
+@pytest.mark.parametrize('question', ['Hi', 'hello there', 'well, hey', 'Good  Evening'])
+def test_greetings(question):
+    assert intent.parse(question).greeting
+
+
+@pytest.mark.parametrize('question, page_request', [
+    ('next page', ()),
+    ('next ones please', ()),
+    ('show more', ()),
+    ('hi, show more', ()),
+    ('more leads', ('leads',)),
+    ('show more Project', ('projects',)),
+    ('more task', ('tasks',)),
+    # A question that names something or asks for a list is not a page request
+    ('show more details of lead Ravi', None),
+    ('show more of project Alpha', None),
+    ('more about user bob', None),
+    ('show more leads and all projects', None),
+    ('what is next', None),
+])
+def test_page_requests(question, page_request):
+    assert intent.parse(question).page_request == page_request
@@ -0,0 +1,145 @@
+"""What each role gets back from the query planner, on mongomock."""
+import asyncio
+import pytest
+from fastapi import HTTPException
+import data_access
+import entity_index
+import intent
+import query_planner
+
+ORG = 'org1'
+ORG_DOC = {'organization': 'Acme'}
+ASSIGNED = 'u-assigned'
+OTHER = 'u-other'
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(data_access, 'db', db)
+    monkeypatch.setattr(data_access, 'MONGO_LOOKUP_PIPELINE', False)
+    db.users.insert_many([
+        {'_id': ASSIGNED, 'username': 'alice', 'organization': ORG, 'email': 'a@x', 'password': 'p',
+         'data': [{'projectData': [{'project_id': 'P1'}], 'leadData': [{'lead_id': 'L1'}]}]},
+        {'_id': OTHER, 'username': 'bob', 'organization': ORG, 'data': []},
+    ])
+    db.project.insert_many([
+        {'project_id': 'P1', 'project_name': 'Alpha', 'org_id': ORG, 'project_status': 'design'},
+        {'project_id': 'P2', 'project_name': 'Beta', 'org_id': ORG, 'project_status': 'execution'},
+    ])
+    db.task.insert_many([
+        {'task_id': 'T1', 'project_id': 'P1', 'task_name': 'paint walls', 'task_status': 'open', 'org_id': ORG},
+        {'task_id': 'T2', 'project_id': 'P1', 'task_name': 'fix door', 'task_status': 'done', 'org_id': ORG},
+        {'task_id': 'T3', 'project_id': 'P2', 'task_name': 'lay floor', 'task_status': 'open', 'org_id': ORG},
+    ])
+    db.Lead.insert_one({'lead_id': 'L1', 'name': 'Dave', 'org_id': ORG, 'status': 'new'})
+    return db
+
+
+def ask(question, role, user_id=ASSIGNED, plan=None):
+    return asyncio.run(execute(question, role, user_id, plan))
+
+
+async def execute(question, role, user_id, plan=None):
+    return await query_planner.execute(
+        intent.parse(question), role, ORG, user_id, ORG_DOC, entity_index.OrgIndex(), plan)
+
+
+def test_unassigned_role_cannot_read_project_or_lead():
+    result = ask('status of project Alpha', 'Designer', OTHER)
+    assert result.context == {'message': "You do not have access to get this project details."}
+    assert result.project_id is None
+    result = ask('details of lead Dave', 'Designer', OTHER)
+    assert result.context == {'message': "You do not have access to this lead."}
+
+
+def test_assigned_role_reads_project_and_lead():
+    result = ask('status of project Alpha', 'Designer')
+    assert result.project_id == 'P1'
+    assert result.context['project_status'] == 'design'
+    assert result.context['assignees'] == ['alice']
+    assert ask('details of lead Dave', 'Designer').lead_id == 'L1'
+
+
+def test_all_tasks_of_project_answers_only_its_tasks():
+    result = ask('all tasks of project Alpha', 'Designer')
+    assert sorted(task['task_name'] for task in result.context['tasks']) == ['fix door', 'paint walls']
+    # The tasks, not the project details
+    assert 'project_status' not in result.context
+    assert result.cursors['tasks'] == {'filter': {'project_id': 'P1'}, 'start': 0, 'offset': None}
+    assert result.project_id == 'P1' and result.task_id == intent.ALL_TASKS_ID
+
+
+def test_all_tasks_of_unassigned_project_are_dropped():
+    result = ask('all tasks of project Alpha', 'Designer', OTHER)
+    assert 'tasks' not in result.context and result.cursors == {}
+    assert result.context['message'] == "You do not have access to get this project details."
+
+
+def test_all_tasks_without_a_project():
+    assert ask('show all tasks', 'ADMIN').context == {'message': "project not found"}
+
+
+def test_senior_architect_is_denied_task_detail_and_user_profile():
+    result = ask('task paint walls of project Alpha', 'Senior Architect')
+    assert 'task_id' not in result.context and result.task_id is None
+    result = ask('user alice', 'Senior Architect')
+    assert result.context == {'message': "You do not have access to get details."}
+
+
+def test_senior_architect_reads_every_list():
+    result = ask('show all projects and all leads', 'Senior Architect')
+    assert sorted(p['project_name'] for p in result.context['projects']) == ['Alpha', 'Beta']
+    assert [lead['name'] for lead in result.context['leads']] == ['Dave']
+    assert 'message' not in result.context
+
+
+def test_default_role_is_denied_org_wide_lists():
+    result = ask('show all projects', 'Designer')
+    assert 'projects' not in result.context
+    assert result.context['message'] == "You do not have access to get details."
+
+
+def test_admin_reads_user_profile_and_task():
+    result = ask('user alice', 'ADMIN')
+    assert result.context['username'] == 'alice'
+    assert result.context['organisation_name'] == 'Acme'
+    assert 'password' not in result.context
+    result = ask('task paint walls of project Alpha', 'ADMIN')
+    assert result.task_id == 'T1' and result.context['task_status'] == 'open'
+
+
+def test_unknown_user_profile_is_404():
+    with pytest.raises(HTTPException) as raised:
+        ask('user zed', 'ADMIN')
+    assert raised.value.status_code == 404
+
+
+def test_not_found_messages_are_merged():
+    result = ask('status of project Gamma and details of lead Erin', 'ADMIN')
+    assert result.context == {'message': "project not found lead not found."}
+    result = ask('task sand floor of project Alpha', 'ADMIN')
+    assert result.context == {'message': "task not found"}
+
+
+def test_shared_plan_reads_each_entity_once(monkeypatch):
+    calls = []
+    lookup = data_access.find_one_with_assignees
+
+    async def counted(collection, filter, *args):
+        calls.append((collection, filter))
+        return await lookup(collection, filter, *args)
+    monkeypatch.setattr(data_access, 'find_one_with_assignees', counted)
+
+    async def scenario():
+        plan = query_planner.Plan()
+        results = await asyncio.gather(
+            execute('status of project Alpha', 'ADMIN', ASSIGNED, plan),
+            execute('all tasks of project Alpha', 'ADMIN', ASSIGNED, plan),
+            execute('task paint walls of project Alpha', 'ADMIN', ASSIGNED, plan))
+        return plan, results
+    plan, results = asyncio.run(scenario())
+    assert calls == [('project', {'project_name': 'Alpha', 'org_id': ORG})]
+    assert len(plan.steps) == 3
+    assert [result.project_id for result in results] == ['P1'] * 3
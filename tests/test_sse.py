@@ -0,0 +1,72 @@
+"""Incremental cleaning and re-framing must match cleaning the whole answer at once."""
+import json
+import random
+import asyncio
+import sse
+
+
+# Short pieces that exercise tags, markdown, newlines and surrounding spaces.
+# Tags stay well under sse.MAX_TAG, past which the two are allowed to differ.
+PIECES = ['a', 'bc', ' ', '  ', '\n', '*', '**', '<', '>', '<b>', '</i>', '<a href="x">',
+          'x < y', 'é', '→']
+
+
+def random_text(rng):
+    return ''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 30)))
+
+
+def random_split(rng, text):
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 6))))
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+def test_text_cleaner_matches_clean_response_text():
+    rng = random.Random(20240601)
+    for _ in range(20000):
+        text = random_text(rng)
+        cleaner = sse.TextCleaner()
+        out = ''.join(cleaner.feed(piece) for piece in random_split(rng, text)) + cleaner.finish()
+        assert out == sse.clean_response_text(text), repr(text)
+
+
+def test_text_cleaner_sends_long_unclosed_tag_as_text():
+    cleaner = sse.TextCleaner()
+    held = cleaner.feed('a <' + 'x' * sse.MAX_TAG)
+    assert held.startswith('a <x')
+
+
+async def collect(chunks, metadata=''):
+    async def reads():
+        for chunk in chunks:
+            yield chunk
+    return [event async for event in sse.reframe(reads(), metadata)]
+
+
+def answer_text(events):
+    text = []
+    for event in events:
+        for frame in event.split('\n\n'):
+            if frame.startswith('data: {'):
+                text.append(json.loads(frame[6:])['choices'][0]['delta']['content'])
+    return ''.join(text)
+
+
+def test_reframe_matches_whole_answer_for_any_byte_split():
+    rng = random.Random(7)
+    for _ in range(2000):
+        tokens = [random_text(rng) for _ in range(rng.randint(0, 8))]
+        body = ''.join(
+            'data: ' + json.dumps({"choices": [{"delta": {"content": token}}]}, ensure_ascii=False) + '\n\n'
+            for token in tokens) + 'data: [DONE]\n\n'
+        # Byte cuts can fall inside a frame or a UTF-8 character
+        events = asyncio.run(collect(random_split(rng, body.encode())))
+        assert answer_text(events) == sse.clean_response_text(''.join(tokens))
+        assert events[-1].endswith('data: [DONE]\n\n')
+
+
+def test_reframe_sends_metadata_with_first_read():
+    metadata = sse.metadata_events('P1', None, 'T1')
+    first = 'data: ' + json.dumps({"choices": [{"delta": {"content": "Hi"}}]}) + '\n\n'
+    events = asyncio.run(collect([first.encode(), b'data: [DONE]\n\n'], metadata))
+    assert events[0] == metadata + sse.token_event('Hi')
+    assert asyncio.run(collect([], metadata)) == [metadata + 'data: [DONE]\n\n']
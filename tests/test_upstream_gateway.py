@@ -0,0 +1,183 @@
+"""Upstream gateway against the local fake chat server (bench.fake_llm_server)."""
+import socket
+import asyncio
+import pytest
+import llm_client
+import upstream_gateway as gateway
+from bench.fake_llm_server import make_app, serve_in_thread
+
+
+DATA = {"model": "fake", "messages": [], "stream": True}
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Start a fake chat server with ``make_app`` settings and point the LLM client at it."""
+    servers = []
+
+    def start(**settings):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        app = make_app(**settings)
+        servers.append(serve_in_thread(app, port))
+        monkeypatch.setattr(llm_client, 'INITIALIZ_URL', f'http://127.0.0.1:{port}/chat')
+        return app
+
+    yield start
+    for server in servers:
+        server.should_exit = True
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """Override gateway settings; the breaker and admission start fresh."""
+    def apply(**values):
+        for key, value in values.items():
+            monkeypatch.setattr(gateway, key, value)
+        monkeypatch.setattr(gateway, 'breaker', gateway.CircuitBreaker(
+            gateway.LLM_BREAKER_FAILURES, gateway.LLM_BREAKER_RESET))
+        monkeypatch.setattr(gateway, '_admission', None)
+    apply()
+    return apply
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await llm_client.close_client()
+    return asyncio.run(main())
+
+
+async def answer(org_id='org'):
+    call = await gateway.open_call(org_id, DATA)
+    return b''.join([chunk async for chunk in call.chunks()])
+
+
+async def status_of(coro):
+    try:
+        await coro
+        return 200
+    except gateway.GatewayError as e:
+        return e.status_code
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = gateway.CircuitBreaker(failures=3, reset=0.1)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == 'open' and not breaker.allow()
+    asyncio.run(asyncio.sleep(0.15))
+    assert breaker.state == 'half-open'
+    # One trial call at a time
+    assert breaker.allow() and not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open'
+    asyncio.run(asyncio.sleep(0.15))
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_breaker_gives_no_verdict_without_one():
+    breaker = gateway.CircuitBreaker(failures=2, reset=30)
+    breaker.record(False)
+    breaker.record(False)
+    breaker.record(None)
+    assert breaker.state == 'open'
+
+
+def test_provider_errors_open_the_breaker_until_it_recovers(fake_llm, settings):
+    settings(LLM_BREAKER_FAILURES=3, LLM_BREAKER_RESET=0.3)
+    fake_llm(status=500)
+
+    async def scenario():
+        statuses = [await status_of(answer()) for _ in range(4)]
+        fake_llm(ttfb=0, token_rate=0, tokens=3)
+        statuses.append(await status_of(answer()))
+        await asyncio.sleep(0.35)
+        # Half-open: the trial call succeeds and closes the breaker
+        statuses.append(await status_of(answer()))
+        statuses.append(await status_of(answer()))
+        return statuses
+    assert run(scenario()) == [502, 502, 502, 503, 503, 200, 200]
+    assert gateway.breaker.state == 'closed'
+
+
+def test_rejected_requests_do_not_open_the_breaker(fake_llm, settings):
+    settings(LLM_BREAKER_FAILURES=2)
+    fake_llm(status=400)
+
+    async def scenario():
+        return [await status_of(answer()) for _ in range(4)]
+    assert run(scenario()) == [502] * 4
+    assert gateway.breaker.state == 'closed'
+
+
+def test_full_wait_queue_answers_429(fake_llm, settings):
+    settings(LLM_GLOBAL_CONCURRENCY=1, LLM_QUEUE_SIZE=1, LLM_QUEUE_TIMEOUT=5)
+    fake_llm(ttfb=0.3, token_rate=0, tokens=3)
+
+    async def scenario():
+        return sorted(await asyncio.gather(*(status_of(answer()) for _ in range(3))))
+    # One running, one waiting, one turned away
+    assert run(scenario()) == [200, 200, 429]
+    assert gateway.admission().waiting == 0 and gateway.admission().active == 0
+
+
+def test_wait_for_a_slot_times_out_with_429(fake_llm, settings):
+    settings(LLM_GLOBAL_CONCURRENCY=1, LLM_QUEUE_SIZE=5, LLM_QUEUE_TIMEOUT=0.1)
+    fake_llm(ttfb=0.5, token_rate=0, tokens=3)
+
+    async def scenario():
+        return sorted(await asyncio.gather(status_of(answer()), status_of(answer())))
+    assert run(scenario()) == [200, 429]
+
+
+def test_late_first_token_answers_504(fake_llm, settings):
+    settings(LLM_FIRST_TOKEN_TIMEOUT=0.2, LLM_HEDGE_AFTER=0)
+    fake_llm(ttfb=0, tokens=3, stall_every=1, stall=2)
+    assert run(status_of(answer())) == 504
+    assert gateway.breaker._failed == 1
+    assert gateway.admission().active == 0
+
+
+def test_hedge_wins_and_the_stalled_response_is_closed(fake_llm, settings):
+    settings(LLM_FIRST_TOKEN_TIMEOUT=3, LLM_HEDGE_AFTER=0.2)
+    # The first request stalls, the hedged second one does not
+    app = fake_llm(ttfb=0, token_rate=0, tokens=5, stall_every=2, stall=5)
+
+    async def scenario():
+        call = await gateway.open_call('org', DATA)
+        chunks = call.chunks()
+        first = await chunks.__anext__()
+        primary_closed = call.response.is_closed
+        rest = b''.join([chunk async for chunk in chunks])
+        return first + rest, primary_closed
+    body, primary_closed = run(scenario())
+    assert app.state.calls == 2
+    assert primary_closed
+    assert body.endswith(b'data: [DONE]\n\n')
+
+
+def test_slots_are_released_when_the_client_goes_away(fake_llm, settings):
+    settings(LLM_GLOBAL_CONCURRENCY=1, LLM_ORG_CONCURRENCY=1)
+    fake_llm(ttfb=0, token_rate=20, tokens=50)
+
+    async def scenario():
+        call = await gateway.open_call('org', DATA)
+        chunks = call.chunks()
+        await chunks.__anext__()
+        assert gateway.admission().active == 1
+        # What StreamingResponse does when the client disconnects
+        await chunks.aclose()
+        gate = gateway.admission()
+        released = (gate.active, gate.waiting, dict(gate._orgs))
+        # The single slot can be taken again
+        await answer()
+        return released
+    assert run(scenario()) == (0, 0, {})
+    assert gateway.breaker.state == 'closed' and gateway.breaker._failed == 0
@@ -0,0 +1,359 @@
+import os
+import time
+import asyncio
+import httpx
+import llm_client
+import metrics
+
+
+# Answers streamed from the LLM at once, in total and per org
+LLM_GLOBAL_CONCURRENCY = int(os.getenv('LLM_GLOBAL_CONCURRENCY', '64'))
+LLM_ORG_CONCURRENCY = int(os.getenv('LLM_ORG_CONCURRENCY', '8'))
+# Requests allowed to wait for a slot, and for how long, before a 429
+LLM_QUEUE_SIZE = int(os.getenv('LLM_QUEUE_SIZE', '128'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '5'))
+# Whole answer, including the wait for a slot, and the first token
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '120'))
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv('LLM_FIRST_TOKEN_TIMEOUT', '30'))
+# Send a second identical request if the first token takes longer than
+# this many seconds; 0 turns hedging off
+LLM_HEDGE_AFTER = float(os.getenv('LLM_HEDGE_AFTER', '0'))
+# Consecutive failures that open the breaker, and seconds it stays open
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', '30'))
+
+
+class GatewayError(Exception):
+    status_code = 502
+    # Whether the breaker counts it: 5xx, transport errors and timeouts say
+    # the LLM is unwell, a rejected request does not
+    breaker_failure = True
+
+
+class Overloaded(GatewayError):
+    status_code = 429
+    breaker_failure = False
+
+
+class CircuitOpen(GatewayError):
+    status_code = 503
+
+
+class UpstreamTimeout(GatewayError):
+    status_code = 504
+
+
+class UpstreamError(GatewayError):
+    status_code = 502
+
+
+class UpstreamRejected(GatewayError):
+    """The LLM refused this request (a 4xx other than 429)."""
+    status_code = 502
+    breaker_failure = False
+
+
+class CircuitBreaker:
+    """Stop calling an upstream that keeps failing.
+
+    After ``failures`` consecutive failures calls are refused for ``reset``
+    seconds; then one trial call is let through, and its outcome closes or
+    re-opens the breaker.
+    """
+
+    def __init__(self, failures, reset):
+        self.failures = failures
+        self.reset = reset
+        self._failed = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record(self, ok):
+        """Record a call's outcome; None gives no verdict (the caller went away)."""
+        self._trial = False
+        if ok is None:
+            return
+        if ok:
+            self._failed = 0
+            self._opened_at = None
+            return
+        self._failed += 1
+        if self._opened_at is not None or self._failed >= self.failures:
+            self._opened_at = time.monotonic()
+
+
+class Admission:
+    """Global and per-org concurrency limits with a bounded wait queue."""
+
+    def __init__(self, total, per_org, queue_size):
+        self.per_org = per_org
+        self.queue_size = queue_size
+        self.waiting = 0
+        self.active = 0
+        self._total = asyncio.Semaphore(total)
+        self._orgs = {}
+
+    async def acquire(self, org_id, timeout):
+        org = self._orgs.get(org_id)
+        if org is None:
+            org = self._orgs[org_id] = [asyncio.Semaphore(self.per_org), 0]
+        if not org[0].locked() and not self._total.locked():
+            # Free slots are taken without queueing
+            org[1] += 1
+            await self._acquire_both(org[0])
+            self.active += 1
+            return
+        if self.waiting >= self.queue_size:
+            if org[1] == 0:
+                del self._orgs[org_id]
+            raise Overloaded("Too many requests waiting for the LLM")
+        org[1] += 1
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._acquire_both(org[0]), timeout)
+        except asyncio.TimeoutError:
+            self._forget(org_id, org)
+            raise Overloaded("Timed out waiting for the LLM")
+        except BaseException:
+            self._forget(org_id, org)
+            raise
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    async def _acquire_both(self, org_slot):
+        await org_slot.acquire()
+        try:
+            await self._total.acquire()
+        except BaseException:
+            org_slot.release()
+            raise
+
+    def release(self, org_id):
+        org = self._orgs[org_id]
+        org[0].release()
+        self._total.release()
+        self.active -= 1
+        self._forget(org_id, org)
+
+    def _forget(self, org_id, org):
+        # Orgs with nobody running or waiting do not keep a semaphore
+        org[1] -= 1
+        if org[1] == 0:
+            del self._orgs[org_id]
+
+
+breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+_admission = None
+
+
+def admission():
+    # Created on first use so the semaphores belong to the running loop
+    global _admission
+    if _admission is None:
+        _admission = Admission(LLM_GLOBAL_CONCURRENCY, LLM_ORG_CONCURRENCY, LLM_QUEUE_SIZE)
+    return _admission
+
+
+def stats():
+    gate = admission()
+    return {'active': gate.active, 'waiting': gate.waiting, 'breaker': breaker.state}
+
+
+async def _send(data, timeout):
+    try:
+        response = await asyncio.wait_for(llm_client.open_stream(data), timeout)
+    except asyncio.TimeoutError:
+        raise UpstreamTimeout("LLM did not respond in time")
+    except httpx.HTTPError as e:
+        raise UpstreamError(f"LLM request failed: {e!r}")
+    if response.status_code != 200:
+        body = (await response.aread()).decode(errors='replace')
+        await response.aclose()
+        metrics.log('upstream_error', 'warning',
+                    status=response.status_code, body=body[:2000])
+        if response.status_code == 429:
+            error = Overloaded
+        elif 400 <= response.status_code < 500:
+            error = UpstreamRejected
+        else:
+            error = UpstreamError
+        raise error(f"LLM answered {response.status_code}")
+    return response
+
+
+async def _first_chunk(response, timeout):
+    chunks = response.aiter_bytes()
+    try:
+        async def first():
+            async for chunk in chunks:
+                if chunk:
+                    return chunk
+            return None
+        return chunks, await asyncio.wait_for(first(), timeout)
+    except asyncio.TimeoutError:
+        await response.aclose()
+        raise UpstreamTimeout("LLM sent no tokens in time")
+    except httpx.HTTPError as e:
+        await response.aclose()
+        raise UpstreamError(f"LLM stream failed: {e!r}")
+
+
+class Call:
+    """One admitted chat completion: call ``chunks()`` once, then it is done."""
+
+    def __init__(self, org_id, data, deadline, response, sent):
+        self.org_id = org_id
+        self.data = data
+        self.deadline = deadline
+        self.response = response
+        self.sent = sent
+        self._released = False
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    async def _race_first_chunk(self):
+        # The first token of the open response, or of a hedged duplicate if
+        # the first one stalls; the slower of the two is closed.
+        ttfb = min(LLM_FIRST_TOKEN_TIMEOUT, self.remaining())
+        primary = asyncio.ensure_future(_first_chunk(self.response, ttfb))
+        if LLM_HEDGE_AFTER <= 0 or LLM_HEDGE_AFTER >= ttfb:
+            return self.response, await primary
+        done, _ = await asyncio.wait([primary], timeout=LLM_HEDGE_AFTER)
+        if done:
+            return self.response, primary.result()
+        metrics.log('upstream_hedge', after_s=LLM_HEDGE_AFTER)
+
+        async def hedge():
+            response = await _send(self.data, ttfb - LLM_HEDGE_AFTER)
+            try:
+                return response, await _first_chunk(response, self.remaining())
+            except BaseException:
+                await response.aclose()
+                raise
+        attempts = {primary: self.response, asyncio.ensure_future(hedge()): None}
+        error = None
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for attempt in done:
+                    del attempts[attempt]
+                    if attempt.exception() is not None:
+                        error = attempt.exception()
+                        continue
+                    result = (self.response, attempt.result()) if attempt is primary else attempt.result()
+                    if winner is None:
+                        winner = result
+                    else:
+                        await result[0].aclose()
+                if winner is not None:
+                    return winner
+            raise error
+        finally:
+            for attempt, response in attempts.items():
+                attempt.cancel()
+                if response is not None:
+                    await response.aclose()
+
+    async def chunks(self):
+        """Yield the body as it arrives, one chunk per network read, until it
+        ends or the deadline passes."""
+        response = self.response
+        ok = None
+        try:
+            response, (chunks, first) = await self._race_first_chunk()
+            metrics.upstream_seconds.observe(time.perf_counter() - self.sent, 'first_token')
+            if first is None:
+                ok = True
+                return
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise UpstreamTimeout("LLM answer passed its deadline")
+                except httpx.HTTPError as e:
+                    raise UpstreamError(f"LLM stream failed: {e!r}")
+                if chunk:
+                    yield chunk
+            ok = True
+        except GatewayError as e:
+            ok = False if e.breaker_failure else None
+            metrics.upstream_errors.inc(type(e).__name__)
+            raise
+        finally:
+            if ok:
+                metrics.upstream_seconds.observe(time.perf_counter() - self.sent, 'stream')
+            breaker.record(ok)
+            await response.aclose()
+            self.release()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            admission().release(self.org_id)
+
+
+async def open_call(org_id, data, deadline=None):
+    """Admit and send a chat request for ``org_id``.
+
+    Raises a GatewayError subclass, carrying the HTTP status to answer with,
+    when the request cannot be served: too many waiting (429), breaker open
+    (503), upstream error status (502) or no response in time (504).
+    """
+    deadline = deadline or time.monotonic() + LLM_DEADLINE
+    try:
+        if breaker.state == 'open':
+            raise CircuitOpen("LLM is unavailable, try again shortly")
+        gate = admission()
+        queued = time.perf_counter()
+        await gate.acquire(org_id, min(LLM_QUEUE_TIMEOUT, deadline - time.monotonic()))
+        metrics.upstream_seconds.observe(time.perf_counter() - queued, 'queue')
+        if not breaker.allow():
+            gate.release(org_id)
+            raise CircuitOpen("LLM is unavailable, try again shortly")
+    except GatewayError as e:
+        metrics.upstream_errors.inc(type(e).__name__)
+        raise
+    sent = time.perf_counter()
+    try:
+        response = await _send(data, deadline - time.monotonic())
+    except UpstreamTimeout:
+        breaker.record(False)
+        metrics.upstream_errors.inc('UpstreamTimeout')
+        gate.release(org_id)
+        raise
+    except GatewayError as e:
+        # A 429 or a rejected request says neither that the LLM is broken
+        # nor that it has recovered: no verdict either way
+        breaker.record(False if e.breaker_failure else None)
+        metrics.upstream_errors.inc(type(e).__name__)
+        gate.release(org_id)
+        raise
+    except BaseException:
+        breaker.record(None)
+        gate.release(org_id)
+        raise
+    metrics.upstream_seconds.observe(time.perf_counter() - sent, 'connect')
+    return Call(org_id, data, deadline, response, sent)